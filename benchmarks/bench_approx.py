@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Benchmark of --approx against the exact calculation: time per file,
+    error relative to the exact value, and the reported standard error,
+    for uncompressed and gzipped float32 images with a brain-like shape.
+
+    Usage: python benchmarks/bench_approx.py [side] [repeats]
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import nibabel as nb
+import numpy as np
+from batch_niistats.modules import nii
+
+INPUTS = {"statistic": "mean", "omit_zeros": True}
+STEPS = (2, 3, 4, 8)
+
+
+def make_file(directory: str, side: int, extension: str) -> str:
+    """Ellipsoid of smoothly varying intensity with noise, zeros outside"""
+    rng = np.random.default_rng(0)
+    i, j, k = np.indices((side, side, side)) / side - 0.5
+    inside = (i / 0.4) ** 2 + (j / 0.45) ** 2 + (k / 0.35) ** 2 < 1
+    data = (1000 + 400 * np.sin(8 * i) * np.cos(6 * k) +
+            rng.normal(0, 50, inside.shape)) * inside
+    path = os.path.join(directory, f"image{extension}")
+    nb.save(nb.Nifti1Image(data.astype(np.float32), np.eye(4)), path)
+    return path
+
+
+def best_time(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    label = nii.stat_label(INPUTS)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in (".nii", ".nii.gz"):
+            path = make_file(directory, side, extension)
+            print(f"{side}^3 float32 {extension}, {label}")
+            exact_time, exact = best_time(
+                lambda: nii.single_nii_calc(path, path, 0, INPUTS, {path}),
+                repeats)
+            exact = exact[label]
+            print(f"{'exact':>10}: {exact_time:6.3f} s")
+
+            for step in STEPS:
+                elapsed, result = best_time(
+                    lambda: nii.approx_nii_calc(path, path, 0, INPUTS,
+                                                {path}, step),
+                    repeats)
+                error = result[label] / exact - 1
+                se = result[f"standard error of {label}"] / exact
+                print(f"{f'step {step}':>10}: {elapsed:6.3f} s  "
+                      f"({exact_time / elapsed:.1f}x)  error {error:+.3%}"
+                      f"  standard error {se:.3%}")
+            print()
+
+
+if __name__ == "__main__":
+    main()
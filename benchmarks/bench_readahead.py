@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Benchmark of the staged read-ahead pipeline (--io-workers) against the
+    default thread pool, where each thread reads, inflates and reduces one
+    file back to back, with the same total number of threads. Reads go
+    through a throttled reader that adds a fixed latency per file and caps
+    bandwidth, to mimic network storage.
+
+    Usage: python benchmarks/bench_readahead.py [n_files] [latency_ms]
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import concurrent.futures
+import os
+import sys
+import tempfile
+import time
+import nibabel as nb
+import numpy as np
+from batch_niistats.modules import nii, pipeline
+
+INPUTS = {"statistic": "mean", "omit_zeros": True}
+BANDWIDTH_BYTES_PER_S = 200 * 1024 ** 2
+
+
+def make_files(directory: str, n_files: int) -> list[str]:
+    """Write n_files smooth 4D .nii.gz files that compress like real data"""
+    rng = np.random.default_rng(0)
+    grid = np.indices((96, 96, 64)).sum(axis=0).astype(np.float32)
+    list_of_files = []
+    for index in range(n_files):
+        data = np.stack([grid + rng.normal(0, 1, grid.shape)
+                         for _ in range(3)], axis=-1).astype(np.float32)
+        path = os.path.join(directory, f"sub-{index:03d}.nii.gz")
+        nb.save(nb.Nifti1Image(data, np.eye(4)), path)
+        list_of_files.append(path)
+    return list_of_files
+
+
+def throttled_read(nii_file: str, latency_s: float) -> bytes:
+    """Read a file, then sleep for the simulated latency and transfer time"""
+    raw_bytes = nii.read_nii_bytes(nii_file)
+    time.sleep(latency_s + len(raw_bytes) / BANDWIDTH_BYTES_PER_S)
+    return raw_bytes
+
+
+def run_default(list_of_files, latency_s, workers):
+    """Each thread reads, decompresses and reduces one file in turn"""
+    def row(nii_file):
+        raw_bytes = throttled_read(nii_file, latency_s)
+        return nii.single_nii_calc(nii_file, nii_file, 0, INPUTS,
+                                   {nii_file}, raw_bytes=raw_bytes)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(row, list_of_files))
+
+
+def run_staged(list_of_files, latency_s, workers, io_workers):
+    """Readers fetch bytes ahead, a separate pool decompresses and reduces"""
+    return pipeline.staged_map(
+        lambda nii_file: throttled_read(nii_file, latency_s),
+        lambda nii_file, raw_bytes: nii.single_nii_calc(
+            nii_file, nii_file, 0, INPUTS, {nii_file}, raw_bytes=raw_bytes),
+        list_of_files,
+        io_workers=io_workers,
+        compute_workers=workers)
+
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    latency_s = (float(sys.argv[2]) if len(sys.argv) > 2 else 100) / 1000
+    workers = os.cpu_count() or 1
+    # what the command line tool uses without --io-workers
+    cli_workers = concurrent.futures.ThreadPoolExecutor()._max_workers
+
+    with tempfile.TemporaryDirectory() as directory:
+        list_of_files = make_files(directory, n_files)
+        print(f"{n_files} files, {latency_s * 1000:.0f} ms latency, "
+              f"{BANDWIDTH_BYTES_PER_S / 1024 ** 2:.0f} MB/s, "
+              f"{workers} compute threads")
+
+        def timed(fn, *args):
+            start = time.perf_counter()
+            result = fn(list_of_files, latency_s, *args)
+            return time.perf_counter() - start, result
+
+        elapsed, expected = timed(run_default, cli_workers)
+        print(f"{f'CLI default pool, {cli_workers} threads':>34}: "
+              f"{elapsed:6.2f} s")
+
+        # compare at the same total number of threads, so that the gain
+        # comes from overlapping reads with compute, not from more threads
+        for io_workers in (4, 8, 16, 32):
+            threads = workers + io_workers
+            default_time, result = timed(run_default, threads)
+            assert result == expected
+            staged_time, result = timed(run_staged, workers, io_workers)
+            assert result == expected
+            print(f"{f'default pool, {threads} threads':>34}: "
+                  f"{default_time:6.2f} s")
+            name = f"staged, {io_workers} readers + {workers} compute"
+            print(f"{name:>34}: {staged_time:6.2f} s  "
+                  f"({default_time / staged_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
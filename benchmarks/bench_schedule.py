@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Benchmark of --schedule cost against datalist order on a skewed
+    datalist: many small files with a few large ones near the end. Tasks
+    sleep for a time proportional to their cost, so the benchmark measures
+    the makespan of the ordering alone, not the machine.
+
+    Usage: python benchmarks/bench_schedule.py [n_rows] [workers]
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import concurrent.futures
+import sys
+import time
+import numpy as np
+from batch_niistats.modules import schedule
+
+SECONDS_PER_UNIT = 0.01
+
+
+def skewed_rows(n_rows: int) -> tuple[list[tuple], dict[str, int]]:
+    """Rows in several directories with heavy-tailed costs, where the
+    largest files come last in the datalist"""
+    rng = np.random.default_rng(0)
+    costs = np.sort(rng.pareto(1.5, n_rows) + 1)
+    rows, cost_of = [], {}
+    for index, cost in enumerate(costs):
+        nii_file = f"sub-{index % 7:02d}/run-{index:04d}.nii"
+        rows.append((nii_file, nii_file, 0))
+        cost_of[nii_file] = int(cost * 100)
+    return rows, cost_of
+
+
+def makespan(rows, cost_of, workers) -> float:
+    """Wall time to run rows in the given order on a pool of workers"""
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        list(executor.map(
+            lambda row: time.sleep(cost_of[row[1]] / 100 * SECONDS_PER_UNIT),
+            rows))
+    return time.perf_counter() - start
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    rows, cost_of = skewed_rows(n_rows)
+    total = sum(cost_of.values()) / 100 * SECONDS_PER_UNIT
+    longest = max(cost_of.values()) / 100 * SECONDS_PER_UNIT
+    print(f"{n_rows} rows, {workers} workers, {total:.2f} s of work, "
+          f"longest row {longest:.2f} s, lower bound "
+          f"{max(total / workers, longest):.2f} s")
+
+    baseline = makespan(rows, cost_of, workers)
+    order = schedule.cost_order(rows,
+                                cost=lambda nii_file, _: cost_of[nii_file])
+    scheduled = makespan([rows[index] for index in order], cost_of, workers)
+
+    print(f"{'datalist order':>16}: {baseline:6.2f} s")
+    print(f"{'cost order':>16}: {scheduled:6.2f} s  "
+          f"({baseline / scheduled:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
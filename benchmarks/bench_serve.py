@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Benchmark of per-job latency with a running `batch_niistats serve`
+    daemon against cold command line runs, for the small per-subject
+    datalists a workflow engine sends. Compares a cold batch_niistats
+    process, a cold batch_niistats_client process, and client.submit
+    called from an already running python process.
+
+    Usage: python benchmarks/bench_serve.py [n_jobs] [rows_per_job]
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import concurrent.futures
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import nibabel as nb
+import numpy as np
+from batch_niistats import client
+
+
+def make_job(directory: str, rows: int) -> str:
+    """Write rows small .nii.gz files and a datalist listing them"""
+    rng = np.random.default_rng(0)
+    lines = ["input_file"]
+    for index in range(rows):
+        path = os.path.join(directory, f"sub-01_run-{index}.nii.gz")
+        data = rng.normal(100, 10, (64, 64, 40)).astype(np.float32)
+        nb.save(nb.Nifti1Image(data, np.eye(4)), path)
+        lines.append(path)
+    datalist = os.path.join(directory, "datalist.csv")
+    with open(datalist, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return datalist
+
+
+def timed(fn, n_jobs) -> list[float]:
+    timings = []
+    for _ in range(n_jobs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    n_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with tempfile.TemporaryDirectory() as directory:
+        datalist = make_job(directory, rows)
+        socket_path = os.path.join(directory, "niistats.sock")
+        daemon = subprocess.Popen(
+            [sys.executable, "-m", "batch_niistats.cli", "serve",
+             "--socket", socket_path],
+            stdout=subprocess.DEVNULL)
+        try:
+            while not client.ping(socket_path):
+                time.sleep(0.05)
+
+            def quiet(command):
+                subprocess.run(command, cwd=directory, check=True,
+                               stdout=subprocess.DEVNULL)
+
+            results = {
+                "cold batch_niistats": timed(lambda: quiet(
+                    [sys.executable, "-m", "batch_niistats.cli", "M",
+                     "--input-glob",
+                     os.path.join(directory, "sub-*.nii.gz")]), n_jobs),
+                "cold client process": timed(lambda: quiet(
+                    [sys.executable, "-m", "batch_niistats.client", "M",
+                     datalist, "--socket", socket_path]), n_jobs),
+                "client.submit": timed(lambda: client.submit(
+                    datalist, "M", socket_path, save=True), n_jobs),
+            }
+
+            # jobs arriving together share the daemon's workers
+            with concurrent.futures.ThreadPoolExecutor(n_jobs) as executor:
+                start = time.perf_counter()
+                list(executor.map(
+                    lambda _: client.submit(datalist, "M", socket_path),
+                    range(n_jobs)))
+                concurrent_time = time.perf_counter() - start
+        finally:
+            client.shutdown(socket_path)
+            daemon.wait(30)
+
+    print(f"{n_jobs} jobs of {rows} rows each (median per job)")
+    baseline = statistics.median(results["cold batch_niistats"])
+    for name, timings in results.items():
+        median = statistics.median(timings)
+        print(f"{name:>20}: {median * 1000:7.1f} ms  "
+              f"({baseline / median:.1f}x)")
+    print(f"{n_jobs} concurrent client.submit jobs: "
+          f"{concurrent_time * 1000:.1f} ms in total")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Benchmark of slab-parallel reductions of a single large volume
+    (mean_nii/sd_nii above nii.PARALLEL_MIN_VOXELS) against the serial
+    reduction, for increasing numbers of slab threads.
+
+    Usage: python benchmarks/bench_slabs.py [side] [repeats]
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import concurrent.futures
+import math
+import os
+import sys
+import time
+import numpy as np
+from batch_niistats.modules import nii
+
+INPUTS = [{"statistic": "mean", "omit_zeros": True},
+          {"statistic": "sd", "omit_zeros": True}]
+
+
+def best_time(nii_array, repeats):
+    """Fastest of repeats runs of every statistic in INPUTS"""
+    timings, results = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = [nii.calc_nii_stat(nii_array, inputs) for inputs in INPUTS]
+        timings.append(time.perf_counter() - start)
+    return min(timings), results
+
+
+def main():
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 384
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    n_cpus = os.cpu_count() or 1
+
+    rng = np.random.default_rng(0)
+    nii_array = rng.normal(100, 20, size=(side, side, side))
+    nii_array[rng.random(nii_array.shape) < 0.3] = 0
+    print(f"{side}^3 float64 volume ({nii_array.nbytes / 1024 ** 2:.0f} MB), "
+          f"{n_cpus} CPUs")
+
+    threshold = nii.PARALLEL_MIN_VOXELS
+    nii.PARALLEL_MIN_VOXELS = math.inf
+    baseline, expected = best_time(nii_array, repeats)
+    nii.PARALLEL_MIN_VOXELS = threshold
+    print(f"{'serial':>12}: {baseline:6.2f} s")
+
+    n_threads = 1
+    while True:
+        nii._slab_pool = concurrent.futures.ThreadPoolExecutor(n_threads)
+        elapsed, results = best_time(nii_array, repeats)
+        nii._slab_pool.shutdown()
+        assert np.allclose(results, expected, rtol=1e-9)
+        print(f"{f'{n_threads} threads':>12}: {elapsed:6.2f} s  "
+              f"({baseline / elapsed:.2f}x)")
+        if n_threads >= n_cpus:
+            break
+        n_threads = min(2 * n_threads, n_cpus)
+    nii._slab_pool = None
+
+
+if __name__ == "__main__":
+    main()
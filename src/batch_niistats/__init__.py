@@ -0,0 +1,32 @@
+"""
+    Calculate descriptive statistics for large numbers of 3D .nii files.
+
+    The command line tool lives in batch_niistats.cli. For use inside
+    other python code, import compute or iter_compute (or their asyncio
+    versions acompute and aiter_compute) from this package:
+
+        >>> import batch_niistats
+        >>> df = batch_niistats.compute("datalist.csv", stats=["M", "S"])
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import importlib
+
+_LAZY_ATTRS = {
+    "compute": "batch_niistats.modules.api",
+    "iter_compute": "batch_niistats.modules.api",
+    "acompute": "batch_niistats.modules.aio",
+    "aiter_compute": "batch_niistats.modules.aio",
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    # import lazily so that light entry points don't load pandas/nibabel
+    if name in _LAZY_ATTRS:
+        return getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
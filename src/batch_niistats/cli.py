@@ -2,11 +2,142 @@
 # -*- coding : utf-8 -*-
 
 import argparse
-from batch_niistats.modules import nii, utils
-import os
+from batch_niistats.modules import (cache, discover, group, nii, pipeline,
+                                    schedule, tuning, utils, watch)
+from collections.abc import Callable, Iterable
+import sys
 import concurrent.futures
 
 
+def single_row_calc(args: argparse.Namespace,
+                    inputs: dict[str, bool | str],
+                    valid_files: set[str]) -> Callable:
+    """Default mode: one output row per datalist row
+
+    The calculation also takes the file's contents, already read, as
+    raw_bytes, for the read-ahead pipeline of --io-workers.
+    """
+    return (
+        lambda row, raw_bytes=None: nii.try_single_nii_calc(
+            row[0],
+            row[1],
+            row[2],
+            inputs,
+            valid_files,
+            raw_bytes=raw_bytes))
+
+
+def series_row_calc(args: argparse.Namespace,
+                    inputs: dict[str, bool | str],
+                    valid_files: set[str]) -> Callable:
+    """--all-volumes: one output row per volume of each file"""
+    return (
+        lambda row: nii.try_series_nii_calc(row[0],
+                                            row[1],
+                                            inputs,
+                                            valid_files))
+
+
+def approx_row_calc(args: argparse.Namespace,
+                    inputs: dict[str, bool | str],
+                    valid_files: set[str]) -> Callable:
+    """--approx: estimates from a sample, with their standard errors"""
+    step = args.approx
+    return (
+        lambda row: nii.try_approx_nii_calc(row[0],
+                                            row[1],
+                                            row[2],
+                                            inputs,
+                                            valid_files,
+                                            step))
+
+
+def profile_row_calc(args: argparse.Namespace,
+                     inputs: dict[str, bool | str],
+                     valid_files: set[str]) -> Callable:
+    """--profile: one output row per slice along each axis"""
+    axes = args.profile
+    return (
+        lambda row: nii.try_profile_nii_calc(row[0],
+                                             row[1],
+                                             row[2],
+                                             axes,
+                                             inputs['omit_zeros'],
+                                             valid_files))
+
+
+# Per-row calculation of each mode and the function that turns its results
+# into the output table. New modes are added here; see row_mode.
+ROW_MODES = {
+    'all_volumes': (series_row_calc, utils.create_series_output_df),
+    'approx': (approx_row_calc, utils.create_output_df),
+    'profile': (profile_row_calc, utils.create_series_output_df),
+    'single': (single_row_calc, utils.create_output_df),
+}
+
+
+def row_mode(args: argparse.Namespace) -> str:
+    """Key in ROW_MODES of the mode chosen on the command line"""
+    return next((mode for mode in ROW_MODES if getattr(args, mode, None)),
+                'single')
+
+
+def map_rows(row_calc: Callable,
+             rows: Iterable[tuple],
+             args: argparse.Namespace,
+             valid_files: set[str]) -> list:
+    """Call row_calc on every row with the workers chosen on the command
+    line, and return the results in datalist order
+
+    With --schedule cost, the largest files are started first.
+    """
+    if args.schedule == 'cost':
+        rows = list(rows)
+        order = schedule.cost_order(rows, args.all_volumes)
+        rows = [rows[index] for index in order]
+
+    if args.io_workers:
+        list_of_data = pipeline.staged_map(
+            lambda row: nii.try_read_nii_bytes(row[1], valid_files),
+            row_calc,
+            rows,
+            io_workers=args.io_workers,
+            compute_workers=args.workers,
+            max_inflight=args.readahead)
+    elif args.workers == 'auto':
+        list_of_data = tuning.AdaptiveWorkers().map(row_calc, rows)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(args.workers) as executor:
+            list_of_data = list(executor.map(row_calc, rows))
+
+    if args.schedule == 'cost':
+        list_of_data = schedule.restore_order(list_of_data, order)
+    return list_of_data
+
+
+def check_args(parser: argparse.ArgumentParser,
+               args: argparse.Namespace):
+    """Exit with a usage error for options that can't be combined"""
+    if args.approx is not None and args.approx < 1:
+        parser.error("--approx STEP must be a positive integer")
+    if args.io_workers and (args.all_volumes or args.group_maps or
+                            args.profile or args.approx):
+        parser.error("--io-workers can't be used with --all-volumes, "
+                     "--group-maps, --profile or --approx")
+    if args.workers == 'auto' and (args.io_workers or args.group_maps):
+        parser.error("--workers auto can't be used with --io-workers or "
+                     "--group-maps")
+    if args.watch and (args.all_volumes or args.group_maps or args.profile
+                       or args.approx or args.io_workers or
+                       args.workers == 'auto'):
+        parser.error("--watch can't be used with --all-volumes, "
+                     "--group-maps, --profile, --approx, --io-workers or "
+                     "--workers auto")
+    if args.schedule == 'cost' and (args.watch or args.group_maps):
+        parser.error("--schedule cost can't be used with --watch or "
+                     "--group-maps")
+
+
 def main():
     """Calculate statistics for batch of .nii files and save .csv of output
 
@@ -22,8 +153,14 @@ def main():
 
     For details & issues, see https://github.com/mcclaskey/batch_niistats.
 
+    Run as `batch_niistats serve` to start a daemon that accepts jobs
+    from batch_niistats_client instead (see modules/server.py).
+
     CMcC 4.9.2025
     """
+    if sys.argv[1:2] == ["serve"]:
+        from batch_niistats.modules import server
+        return server.main(sys.argv[2:])
 
     ##########################################################################
     # handle input arguments
@@ -63,6 +200,10 @@ def main():
             "copy/paste.\n\nThe 'volume_0basedindex' column or the SPM synax"
             " can be omitted\nif all files are 3D NIfTIs or if you only want "
             "to calculate\nstatistics on the first volume of each image.\n\n"
+            "To calculate statistics for every volume of 4D files, use\n"
+            "--all-volumes. Each file is then read once, volume columns\n"
+            "and SPM syntax are ignored, and the output has one row per\n"
+            "volume.\n\n"
             ),
         formatter_class=argparse.RawTextHelpFormatter,
     )
@@ -74,8 +215,124 @@ def main():
          "  m: mean of all voxels\n"
          "  S: stddev of nonzero voxels\n"
          "  s: stddev of all voxels")
+    parser.add_argument(
+        "--input-dir",
+        action="append",
+        default=[],
+        metavar="DIR",
+        help="Instead of asking for a datalist, process every .nii and\n"
+        ".nii.gz file under DIR (can be given more than once).\n"
+        "Calculations start while directories are still scanned.")
+    parser.add_argument(
+        "--input-glob",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="Like --input-dir, but process .nii/.nii.gz files that\n"
+        "match PATTERN. Use '**' to match any number of\n"
+        "directories, e.g. '/data/bids/sub-*/**/*_T1w.nii.gz'.\n"
+        "Quote the pattern so that the shell doesn't expand it.")
+    parser.add_argument(
+        "--save-datalist",
+        metavar="CSV",
+        help="With --input-dir/--input-glob, save the files that were\n"
+        "found as a datalist that can be reused. The output .csv\n"
+        "is saved next to it.")
+    parser.add_argument(
+        "--workers",
+        type=utils.parse_workers,
+        metavar="N",
+        help="Number of files to calculate at once (default: chosen by\n"
+        "python). Use 'auto' to measure I/O wait and CPU use while\n"
+        "running and adjust the number as the batch goes (not with\n"
+        "--io-workers or --group-maps). The chosen number is\n"
+        "printed so that it can be reused.")
+    parser.add_argument(
+        "--io-workers",
+        type=utils.parse_positive_int,
+        metavar="N",
+        help="Read files ahead with N reader threads, and decompress\n"
+        "and calculate in a separate pool (one thread per CPU).\n"
+        "Helps when files are on slow or high-latency storage.\n"
+        "Not used with --all-volumes or --group-maps.")
+    parser.add_argument(
+        "--readahead",
+        type=utils.parse_positive_int,
+        metavar="N",
+        help="With --io-workers, hold at most N files that have been\n"
+        "read but not yet calculated (default: twice the number of\n"
+        "threads). Lower it if files are very large.")
+    parser.add_argument(
+        "--schedule",
+        choices=["datalist", "cost"],
+        default="datalist",
+        help="Order in which files are started. 'datalist' (default)\n"
+        "follows the datalist; 'cost' reads the headers first and\n"
+        "starts the largest files first, grouping files in the same\n"
+        "directory, so the run doesn't end waiting on one big file.\n"
+        "The output .csv is in datalist order either way.")
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Keep uncompressed copies of .nii.gz files in DIR, so that\n"
+        "files read again in later rows or runs (e.g. templates)\n"
+        "are not decompressed again. Can be shared by several\n"
+        "jobs at once.")
+    parser.add_argument(
+        "--cache-size",
+        type=utils.parse_size,
+        default=cache.DEFAULT_MAX_BYTES,
+        metavar="SIZE",
+        help="With --cache-dir, disk space the cache may use, e.g.\n"
+        "500M or 10G (default: 10G). Files used longest ago are\n"
+        "removed first.")
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and poll the datalist (or --input-dir/\n"
+        "--input-glob) for new or changed files. Only those are\n"
+        "calculated, and their rows are appended to the output\n"
+        ".csv. Stop with Ctrl+C.")
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=5.0,
+        metavar="SECONDS",
+        help="With --watch, seconds between polls (default: 5).")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--all-volumes",
+        action="store_true",
+        help="Calculate the statistic for every volume of each file,\n"
+        "reading each file once. Outputs one row per volume.")
+    mode.add_argument(
+        "--group-maps",
+        action="store_true",
+        help="Instead of one value per image, save voxelwise group\n"
+        "mean, sd and count maps across all images as .nii.gz\n"
+        "files. Images must have the same shape and affine. M/S\n"
+        "count only nonzero values at each voxel, m/s count all.")
+    mode.add_argument(
+        "--approx",
+        nargs="?",
+        const=nii.APPROX_STEP,
+        type=int,
+        metavar="STEP",
+        help="Quick estimate for triage: in every slice, use only\n"
+        f"every STEP-th row of voxels (default: {nii.APPROX_STEP}). Adds a\n"
+        "column with the standard error of each estimate.")
+    mode.add_argument(
+        "--profile",
+        type=utils.parse_axes,
+        metavar="AXES",
+        help="Calculate the mean and sd of every slice along each of\n"
+        "AXES (comma-separated x, y and z, e.g. 'z' or 'x,y,z'),\n"
+        "for slice artifact QC. Each volume is read once. M/S use\n"
+        "only nonzero voxels, m/s all voxels. Outputs one row per\n"
+        "slice.")
 
     args = parser.parse_args()
+    check_args(parser, args)
 
     ##########################################################################
     # start with basic info: ask user for csv, report, check files
@@ -83,46 +340,77 @@ def main():
 
     # parse inputs
     inputs = utils.parse_inputs(args.option)
+    cache.configure(args.cache_dir, args.cache_size)
 
-    # ask for datalist (csv, first row must be "input_file")
-    datalist_filepath = utils.askfordatalist()
+    # ask for datalist (csv, first row must be "input_file"), unless
+    # files are found by walking directories
+    datalist_rows = discover.DatalistRows(args.input_dir,
+                                          args.input_glob,
+                                          args.save_datalist)
+    datalist_filepath = datalist_rows.datalist_filepath
 
     # print info for user reference
     timestamp = utils.get_timestamp()
     print(
         f"[{timestamp}] batch_niistats.py\n\nCompiling .csv file with "
         f"{inputs['statistic']} values of .nii files listed in:\n"
-        f"{datalist_filepath}\n"
+        f"{datalist_rows.source}\n"
         )
 
-    # read it and check for missing files
-    datalist = utils.load_datalist(datalist_filepath)
-    valid_files = {f for f in datalist['file'] if os.path.exists(f)}
+    # read it and check for missing files. Discovered files are added to
+    # the list as they are found, so that calculations start right away
+    rows = datalist_rows.rows()
+    valid_files = datalist_rows.valid_files
+
+    output_path = utils.write_output_df_path(
+        datalist_filepath,
+        args.option,
+        timestamp)
 
     ##########################################################################
-    # Loop across rows in csv, call single_nii_calc, add result to list
+    # Watch mode: keep polling and append rows for new or changed files
     ##########################################################################
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        single_nii_results = executor.map(
-            lambda args: nii.try_single_nii_calc(args[0],
-                                                 args[1],
-                                                 args[2],
-                                                 inputs,
-                                                 valid_files),
-            zip(datalist['input_file'],
-                datalist['file'],
-                datalist['volume_0basedindex'])
-            )
-        list_of_data = list(single_nii_results)
+    if args.watch:
+        watch.watch(datalist_rows.load, inputs, output_path,
+                    interval=args.poll_interval,
+                    workers=args.workers)
+
+        return None
+
+    ##########################################################################
+    # Group maps: stream all rows through one voxelwise accumulator
+    ##########################################################################
+    if args.group_maps:
+        list(rows)  # group maps need the whole list up front
+        datalist = datalist_rows.datalist()
+        accumulator, list_of_data = group.group_maps(datalist,
+                                                     inputs,
+                                                     valid_files,
+                                                     args.workers)
+        try:
+            group.save_group_maps(accumulator,
+                                  output_path.removesuffix('.csv'))
+        except ValueError as e:
+            print(f"Group maps were not saved: {e}\n")
+        combined_df = utils.create_output_df(datalist, list_of_data)
+        utils.save_output_csv(combined_df, output_path)
+
+        return combined_df
+
+    ##########################################################################
+    # Loop across rows in csv, call the mode's calculation on each row
+    ##########################################################################
+    make_row_calc, create_output_df = ROW_MODES[row_mode(args)]
+    list_of_data = map_rows(make_row_calc(args, inputs, valid_files),
+                            rows,
+                            args,
+                            valid_files)
+    datalist = datalist_rows.datalist()
 
     ##########################################################################
     # create dataframe, show to user, save to csv, end program
     ##########################################################################
-    output_path = utils.write_output_df_path(
-        datalist_filepath,
-        args.option,
-        timestamp)
-    combined_df = utils.create_output_df(datalist, list_of_data)
+    combined_df = create_output_df(datalist, list_of_data)
     utils.save_output_csv(combined_df, output_path)
 
     return combined_df
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Thin client for a running `batch_niistats serve` daemon. Sends a
+    datalist (or a list of files) and an option over the daemon's Unix
+    socket and gets back the output table. Uses only the standard
+    library, so it starts quickly; the daemon does all the work.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+
+DEFAULT_SOCKET = os.environ.get(
+    "BATCH_NIISTATS_SOCKET",
+    os.path.join(tempfile.gettempdir(),
+                 f"batch_niistats-{getattr(os, 'getuid', lambda: 0)()}.sock"))
+
+
+def request(message: dict,
+            socket_path: str = DEFAULT_SOCKET,
+            timeout: float | None = None) -> dict:
+    """Send one JSON request to the daemon and return its JSON response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(message) + "\n").encode())
+        with sock.makefile("rb") as response:
+            line = response.readline()
+    if not line:
+        raise ConnectionError(f"No response from {socket_path}")
+    return json.loads(line)
+
+
+def submit(files_or_datalist: str | list[str],
+           option: str = "M",
+           socket_path: str = DEFAULT_SOCKET,
+           save: bool = False,
+           timeout: float | None = None) -> dict:
+    """Run a batch on the daemon and return the output table
+
+    files_or_datalist is a path to a datalist .csv or a list of .nii
+    paths (SPM syntax is supported); relative paths are resolved here.
+    Returns a dict with 'columns' and 'data' (one list per row, in
+    datalist order, with None for empty values), as produced by
+    utils.create_output_df, and 'output_path' if save is True and a
+    datalist was given, in which case the daemon saved the .csv next to
+    it like the command line tool does. Raises RuntimeError if the job
+    fails.
+    """
+    if isinstance(files_or_datalist, str):
+        files_or_datalist = os.path.abspath(files_or_datalist)
+    else:
+        files_or_datalist = [file if "://" in file else os.path.abspath(file)
+                             for file in files_or_datalist]
+
+    response = request({"command": "run",
+                        "input": files_or_datalist,
+                        "option": option,
+                        "save": save},
+                       socket_path,
+                       timeout)
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error", "unknown error"))
+    return response["table"] | {"output_path": response.get("output_path")}
+
+
+def ping(socket_path: str = DEFAULT_SOCKET) -> bool:
+    """Whether a daemon is answering on socket_path"""
+    try:
+        return request({"command": "ping"}, socket_path, timeout=5)["ok"]
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def shutdown(socket_path: str = DEFAULT_SOCKET):
+    """Ask the daemon to finish running jobs and stop"""
+    request({"command": "shutdown"}, socket_path, timeout=5)
+
+
+def main():
+    """Command line client: run a datalist on the daemon, save the .csv"""
+    parser = argparse.ArgumentParser(
+        prog="batch_niistats_client",
+        description="Send a datalist to a running 'batch_niistats serve'\n"
+        "daemon. The output .csv is saved next to the datalist, as\n"
+        "with batch_niistats.",
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("option", choices=["M", "m", "S", "s"],
+                        help="Statistic to calculate, as for batch_niistats")
+    parser.add_argument("datalist", help="Path to the datalist .csv")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, metavar="PATH",
+                        help=f"Daemon socket (default: {DEFAULT_SOCKET})")
+    args = parser.parse_args()
+
+    try:
+        result = submit(args.datalist, args.option, args.socket, save=True)
+    except (OSError, RuntimeError) as e:
+        print(f"batch_niistats_client: {e}", file=sys.stderr)
+        return 1
+    print(f"Output saved to file:\n{result['output_path']}")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
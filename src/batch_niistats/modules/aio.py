@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    asyncio interface to batch_niistats, for use inside async services.
+    Blocking .nii loads run in an executor so the event loop stays free.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+from collections.abc import AsyncIterator, Iterable
+import pandas as pd
+from batch_niistats.modules import api, utils
+
+
+async def aiter_compute(
+        files_or_datalist: str | pd.DataFrame | Iterable[str],
+        stats: str | Iterable[str] = "M",
+        executor: concurrent.futures.Executor | None = None,
+        max_concurrency: int = 4,
+        semaphore: asyncio.Semaphore | None = None
+        ) -> AsyncIterator[tuple[int, dict[str, str | int | float]]]:
+    """Calculate statistics and yield (row index, result) as rows finish
+
+    Async version of api.iter_compute. Each row runs in executor (the
+    event loop's default executor if None), so one worker pool can be
+    shared by many concurrent calls. At most max_concurrency rows of this
+    call are in the executor at once; pass a shared semaphore instead to
+    put one limit on several calls.
+
+    Closing or cancelling the iterator cancels rows that have not started.
+    Rows that are already running in the executor finish in the
+    background, because threads cannot be interrupted.
+
+    Example:
+        >>> async for row_index, result in aiter_compute(files, "M"):
+        ...     print(row_index, result["mean of nonzero voxels"])
+    """
+    loop = asyncio.get_running_loop()
+    list_of_inputs = api.parse_stats(stats)
+    datalist = await loop.run_in_executor(
+        executor, api.as_datalist, files_or_datalist)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_row(index, row):
+        async with semaphore:
+            result = await loop.run_in_executor(
+                executor,
+                functools.partial(api.try_multi_nii_calc,
+                                  *row,
+                                  list_of_inputs))
+        return index, result
+
+    tasks = [asyncio.ensure_future(run_row(index, row))
+             for index, row in enumerate(api.row_tasks(datalist))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def acompute(files_or_datalist: str | pd.DataFrame | Iterable[str],
+                   stats: str | Iterable[str] = "M",
+                   executor: concurrent.futures.Executor | None = None,
+                   max_concurrency: int = 4
+                   ) -> pd.DataFrame:
+    """Async version of api.compute, returns the output dataframe"""
+    loop = asyncio.get_running_loop()
+    datalist = await loop.run_in_executor(
+        executor, api.as_datalist, files_or_datalist)
+    list_of_data = [None] * len(datalist)
+    async for index, result in aiter_compute(datalist,
+                                             stats,
+                                             executor,
+                                             max_concurrency):
+        list_of_data[index] = result
+
+    return utils.create_output_df(datalist, list_of_data)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Importable python interface to batch_niistats, for use inside other
+    python pipelines. Does not parse command line arguments, open file
+    dialogs or write files.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+from collections.abc import Iterable, Iterator
+import concurrent.futures
+import numpy as np
+import pandas as pd
+from batch_niistats.modules import nii, storage, utils
+
+
+BACKENDS = {
+    "thread": concurrent.futures.ThreadPoolExecutor,
+    "process": concurrent.futures.ProcessPoolExecutor,
+}
+
+
+def as_datalist(files_or_datalist: str | pd.DataFrame | Iterable[str]
+                ) -> pd.DataFrame:
+    """Convert any supported input to a datalist like load_datalist's
+
+    Accepts a path to a .csv datalist, a dataframe with an 'input_file'
+    column (and optionally 'volume_0basedindex'), or an iterable of .nii
+    paths, which may use SPM volume syntax. Dataframes that were already
+    returned by load_datalist are used as they are.
+    """
+    if isinstance(files_or_datalist, str):
+        if files_or_datalist.lower().endswith('.csv'):
+            return utils.load_datalist(files_or_datalist)
+        files_or_datalist = [files_or_datalist]
+
+    if isinstance(files_or_datalist, pd.DataFrame):
+        if 'file' in files_or_datalist.columns:
+            return files_or_datalist  # already resolved by load_datalist
+        return utils.prepare_datalist(files_or_datalist.copy())
+
+    return utils.prepare_datalist(
+        pd.DataFrame({'input_file': list(files_or_datalist)}))
+
+
+def parse_stats(stats: str | Iterable[str]) -> list[dict[str, bool | str]]:
+    """Parse one or more FSL-style options (M, m, S, s) into input dicts"""
+    if isinstance(stats, str):
+        stats = [stats]
+
+    list_of_inputs = []
+    for option in stats:
+        inputs = utils.parse_inputs(option)
+        if not inputs:
+            raise ValueError(f"Unsupported statistic option: {option!r}. "
+                             "Use one of M, m, S, s.")
+        list_of_inputs.append(inputs)
+    return list_of_inputs
+
+
+def row_tasks(datalist: pd.DataFrame) -> Iterator[tuple]:
+    """Yield (input_file, file, volume) for each row of a datalist"""
+    return zip(datalist['input_file'],
+               datalist['file'],
+               datalist['volume_0basedindex'])
+
+
+def try_multi_nii_calc(nii_rawinput: str,
+                       nii_file: str,
+                       nii_volume: int,
+                       list_of_inputs: list[dict[str, bool | str]]
+                       ) -> dict[str, str | int | float]:
+    """Call multi_nii_calc for one row, recording errors in the output
+
+    Existence is checked here rather than passed in as a set so that
+    each task stays cheap to send to a process pool. Unlike
+    try_single_nii_calc, errors return a row with empty values and the
+    error in the 'note' column, so that streamed results keep their row.
+    """
+    valid_files = {nii_file} if storage.exists(nii_file) else set()
+    try:
+        return nii.multi_nii_calc(nii_rawinput,
+                                  nii_file,
+                                  nii_volume,
+                                  list_of_inputs,
+                                  valid_files)
+    except Exception as e:
+        print(f"Error processing {nii_file}: {e}")
+        output = {'input_file': nii_rawinput,
+                  'filename': nii_file,
+                  'volume_0basedindex': nii_volume}
+        for inputs in list_of_inputs:
+            output[nii.stat_label(inputs)] = None
+        output['note'] = f"error: {e}"
+        return output
+
+
+def iter_compute(files_or_datalist: str | pd.DataFrame | Iterable[str],
+                 stats: str | Iterable[str] = "M",
+                 workers: int | None = None,
+                 backend: str = "thread"
+                 ) -> Iterator[tuple[int, dict[str, str | int | float]]]:
+    """Calculate statistics and yield (row index, result) as rows finish
+
+    Results are yielded in order of completion, not in datalist order.
+    The row index is the 0-based position of the row in the datalist and
+    can be used to put results back in order. Each result is a dict like
+    the ones returned by nii.single_nii_calc, with one column per option
+    in stats.
+    """
+    datalist = as_datalist(files_or_datalist)
+    list_of_inputs = parse_stats(stats)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unsupported backend: {backend!r}. "
+                         f"Use one of {', '.join(BACKENDS)}.")
+
+    with BACKENDS[backend](max_workers=workers) as executor:
+        futures = {
+            executor.submit(try_multi_nii_calc,
+                            nii_rawinput,
+                            nii_file,
+                            nii_volume,
+                            list_of_inputs): index
+            for index, (nii_rawinput, nii_file, nii_volume)
+            in enumerate(row_tasks(datalist))
+        }
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # stop queued rows if the caller stops iterating early
+            for future in futures:
+                future.cancel()
+
+
+def compute(files_or_datalist: str | pd.DataFrame | Iterable[str],
+            stats: str | Iterable[str] = "M",
+            workers: int | None = None,
+            backend: str = "thread",
+            as_array: bool = False
+            ) -> pd.DataFrame | np.ndarray:
+    """Calculate statistics for a batch of .nii files and return them
+
+    Returns the same dataframe that the command line tool saves to .csv,
+    with one column per option in stats. If as_array is True, returns a
+    float NumPy array of shape (rows, len(stats)) instead, with NaN where
+    a file was missing or could not be read.
+
+    Example:
+        >>> import batch_niistats
+        >>> df = batch_niistats.compute(["sub-01.nii.gz", "sub-02.nii.gz"],
+        ...                             stats=["M", "S"])
+    """
+    datalist = as_datalist(files_or_datalist)
+    list_of_data = [None] * len(datalist)
+    for index, result in iter_compute(datalist, stats, workers, backend):
+        list_of_data[index] = result
+
+    if as_array:
+        labels = [nii.stat_label(inputs) for inputs in parse_stats(stats)]
+        return np.array([[np.nan if row[label] is None else row[label]
+                          for label in labels]
+                         for row in list_of_data],
+                        dtype=float).reshape(len(list_of_data), len(labels))
+
+    return utils.create_output_df(datalist, list_of_data)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Optional on-disk cache of decompressed .nii.gz files (--cache-dir).
+    Files that are read again and again (templates, reference images) are
+    inflated once and later opened as plain .nii files, which nibabel can
+    memory-map. The cache is kept under a disk budget by removing the
+    least recently used files.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+# how long to wait for another worker that is decompressing the same file,
+# after which its lock is treated as left over from a crashed job
+LOCK_TIMEOUT = 600.0
+LOCK_POLL = 0.05
+
+
+class DecompressedCache:
+    """Directory of uncompressed copies of .nii.gz files
+
+    Entries are keyed by the absolute path, size and modification time of
+    the original file, so a changed file gets a new entry. Each entry is
+    written to a temporary file and renamed into place, and a lock file
+    makes sure only one worker or job decompresses a given file while the
+    others wait for it. Using an entry updates its modification time, and
+    once the cache is larger than max_bytes the entries used longest ago
+    are removed.
+    """
+
+    def __init__(self,
+                 cache_dir: str,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry_path(self, input_file: str) -> str:
+        """Return where the uncompressed copy of input_file is kept"""
+        stat = os.stat(input_file)
+        key = hashlib.sha1(
+            f"{os.path.abspath(input_file)}\0{stat.st_size}\0"
+            f"{stat.st_mtime_ns}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.nii")
+
+    def lookup(self, input_file: str) -> str | None:
+        """Return the cached copy of input_file if there is one"""
+        entry = self.entry_path(input_file)
+        try:
+            os.utime(entry)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def populate(self, input_file: str) -> str | None:
+        """Decompress input_file into the cache, or wait for another worker
+        that is already doing it. Returns the cached copy, or None if the
+        file doesn't fit in the cache or the other worker didn't finish.
+        """
+        entry = self.entry_path(input_file)
+        lock = entry + '.lock'
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            if os.path.exists(entry):
+                return self.lookup(input_file)
+            try:
+                os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                if time.monotonic() > deadline:
+                    _remove(lock)  # left over from a crashed job
+                    return None
+                time.sleep(LOCK_POLL)
+
+        try:
+            if os.path.exists(entry):  # finished just before we locked
+                return self.lookup(input_file)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                            suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as tmp, \
+                        gzip.open(input_file, 'rb') as source:
+                    shutil.copyfileobj(source, tmp, 1024 ** 2)
+                if os.path.getsize(tmp_path) > self.max_bytes:
+                    return None
+                os.replace(tmp_path, entry)
+            finally:
+                _remove(tmp_path)
+        finally:
+            _remove(lock)
+
+        self.evict(keep=entry)
+        return entry
+
+    def evict(self, keep: str | None = None):
+        """Remove least recently used entries until within max_bytes"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for dir_entry in it:
+                if dir_entry.name.endswith('.nii'):
+                    try:
+                        stat = dir_entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size,
+                                    dir_entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                _remove(path)
+                total -= size
+
+    def cached_path(self, input_file: str) -> str:
+        """Return the path to read input_file from
+
+        .nii.gz files are served from the cache (decompressing them the
+        first time). Other files, and files that can't be cached, are
+        read from their original path.
+        """
+        if not str(input_file).endswith('.gz') or \
+                '://' in str(input_file):
+            return input_file
+        try:
+            return self.lookup(input_file) or \
+                self.populate(input_file) or input_file
+        except OSError:
+            return input_file
+
+    def open(self, input_file: str) -> io.BufferedReader | None:
+        """Open the cached copy of a .nii.gz file for reading
+
+        Unlike cached_path, the entry is opened here, so it can still be
+        read if another worker or job evicts it straight afterwards.
+        Returns None if input_file should be read from its original path.
+        """
+        for _ in range(2):  # populate again if evicted before it's opened
+            entry = self.cached_path(input_file)
+            if entry == input_file:
+                return None
+            try:
+                return open(entry, 'rb')
+            except FileNotFoundError:
+                continue
+        return None
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+_CACHE = None
+
+
+def configure(cache_dir: str | None,
+              max_bytes: int = DEFAULT_MAX_BYTES) -> DecompressedCache | None:
+    """Turn the cache on for all loads (or off, if cache_dir is None)"""
+    global _CACHE
+    _CACHE = DecompressedCache(cache_dir, max_bytes) if cache_dir else None
+    return _CACHE
+
+
+def cached_path(input_file: str) -> str:
+    """Path to read input_file from, using the cache if it is turned on"""
+    return input_file if _CACHE is None else _CACHE.cached_path(input_file)
+
+
+def open_cached(input_file: str) -> io.BufferedReader | None:
+    """Open the cached copy of input_file, if the cache is turned on and
+    input_file can be cached. Otherwise returns None.
+    """
+    return None if _CACHE is None else _CACHE.open(input_file)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Functions that find .nii files in directory trees, as an alternative
+    to a hand-built datalist. Directories are scanned in parallel with
+    os.scandir, which helps most on network filesystems. DatalistRows
+    gives the rows to calculate from either source.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+from collections.abc import Iterable, Iterator
+import concurrent.futures
+import fnmatch
+import os
+import re
+import pandas as pd
+from batch_niistats.modules import storage, utils
+
+NII_SUFFIXES = ('.nii', '.nii.gz')
+WILDCARD_CHARS = re.compile(r'[*?[]')
+
+
+def is_nii(filename: str) -> bool:
+    """Check whether a filename has a .nii or .nii.gz extension"""
+    return filename.lower().endswith(NII_SUFFIXES)
+
+
+def split_glob(pattern: str) -> tuple[str, list[str]]:
+    """Split a glob pattern into its literal root directory and the rest
+
+    Returns the longest leading path without wildcards ('' for the current
+    directory) and the remaining pattern components, which are empty if
+    the pattern has no wildcards. '**' matches any number of directories,
+    as in glob.glob(recursive=True).
+    """
+    drive, rest = os.path.splitdrive(pattern)
+    root = drive + (os.sep if rest[:1] in ('/', os.sep) else '')
+    parts = [part for part in re.split(r'[\\/]', rest) if part]
+
+    n_literal = 0
+    while n_literal < len(parts) and \
+            not WILDCARD_CHARS.search(parts[n_literal]):
+        n_literal += 1
+    if n_literal:
+        root = os.path.join(root, *parts[:n_literal])
+
+    return root, parts[n_literal:]
+
+
+def _closure(parts: list[str], states: set[int]) -> set[int]:
+    """Add the states reached by letting '**' match zero directories"""
+    states = set(states)
+    for state in sorted(states):
+        while state < len(parts) and parts[state] == '**':
+            state += 1
+            states.add(state)
+    return states
+
+
+def _advance(parts: list[str], states: set[int], name: str) -> set[int]:
+    """Return the pattern states reached after matching one path entry
+
+    As with glob, names starting with '.' are only matched by pattern
+    components that also start with '.'.
+    """
+    next_states = set()
+    hidden = name.startswith('.')
+    for state in _closure(parts, states):
+        if state == len(parts) or \
+                hidden and not parts[state].startswith('.'):
+            continue
+        if parts[state] == '**':
+            next_states.add(state)
+        elif fnmatch.fnmatch(name, parts[state]):
+            next_states.add(state + 1)
+    return next_states
+
+
+def scan_dir(dirpath: str,
+             parts: list[str],
+             states: set[int]
+             ) -> tuple[list[str], list[tuple[str, set[int]]]]:
+    """Scan one directory, return matching .nii files and dirs to descend
+
+    Subdirectories are only returned if the rest of the pattern could still
+    match something inside them. Symlinked directories are not followed.
+    """
+    files, subdirs = [], []
+    try:
+        with os.scandir(dirpath or '.') as entries:
+            for entry in entries:
+                next_states = _advance(parts, states, entry.name)
+                if not next_states:
+                    continue
+                path = os.path.join(dirpath, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if min(next_states) < len(parts):
+                        subdirs.append((path, next_states))
+                elif is_nii(entry.name) and entry.is_file() and \
+                        len(parts) in _closure(parts, next_states):
+                    files.append(path)
+    except OSError as e:
+        print(f"Could not scan directory {dirpath}: {e}")
+
+    return sorted(files), subdirs
+
+
+def iter_nii_files(input_dirs: Iterable[str] = (),
+                   input_globs: Iterable[str] = (),
+                   workers: int = 16
+                   ) -> Iterator[str]:
+    """Find .nii/.nii.gz files and yield their paths as they are found
+
+    Every directory under input_dirs is searched, skipping hidden files
+    and directories (names starting with '.', e.g. the ._ files macOS
+    leaves on network shares). Each pattern in input_globs is matched like
+    glob.glob(pattern, recursive=True), which also skips hidden names
+    unless the pattern spells out the '.', and only directories that could
+    match are scanned. Directories are scanned
+    by a pool of workers, so files are yielded in the order they are
+    found, not sorted. Each file is yielded only once.
+    """
+    seen = set()
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        pending = {}  # future -> pattern components it is matching
+        for input_dir in input_dirs:
+            parts = ['**', '*']
+            pending[executor.submit(scan_dir, input_dir, parts, {0})] = parts
+        for pattern in input_globs:
+            root, parts = split_glob(pattern)
+            if not parts:
+                if is_nii(root) and os.path.isfile(root) and \
+                        root not in seen:
+                    seen.add(root)
+                    yield root
+                continue
+            pending[executor.submit(scan_dir, root, parts, {0})] = parts
+
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                parts = pending.pop(future)
+                files, subdirs = future.result()
+                for dirpath, states in subdirs:
+                    pending[executor.submit(scan_dir,
+                                            dirpath,
+                                            parts,
+                                            states)] = parts
+                for nii_file in files:
+                    if nii_file not in seen:
+                        seen.add(nii_file)
+                        yield nii_file
+
+
+class DatalistRows:
+    """Rows to calculate, from a datalist .csv or from discovered files
+
+    With input_dirs or input_globs, files are found with iter_nii_files
+    and rows() yields each one as soon as it is found, so calculations
+    start right away. Otherwise the user is asked for a datalist .csv.
+    datalist_filepath is the .csv that output paths are based on (for
+    discovered files, save_datalist or discovered_datalist.csv in the
+    working directory), and source is where the rows come from, for
+    reporting.
+    """
+
+    def __init__(self,
+                 input_dirs: Iterable[str] = (),
+                 input_globs: Iterable[str] = (),
+                 save_datalist: str | None = None):
+        self.input_dirs = list(input_dirs)
+        self.input_globs = list(input_globs)
+        self.save_datalist = save_datalist
+        self.discovering = bool(self.input_dirs or self.input_globs)
+        self.valid_files = set()
+        self._files = []
+        self._datalist = None
+
+        if self.discovering:
+            self.datalist_filepath = save_datalist or os.path.join(
+                os.getcwd(), "discovered_datalist.csv")
+            self.source = "\n".join(self.input_dirs + self.input_globs)
+        else:
+            self.datalist_filepath = utils.askfordatalist()
+            self.source = self.datalist_filepath
+
+    def rows(self) -> Iterator[tuple[str, str, int]]:
+        """Yield (input_file, file, volume) rows
+
+        Files that exist are added to valid_files before their rows are
+        yielded.
+        """
+        if self.discovering:
+            for nii_file in iter_nii_files(self.input_dirs,
+                                           self.input_globs):
+                self._files.append(nii_file)
+                self.valid_files.add(nii_file)
+                yield nii_file, nii_file, 0
+            return
+
+        self._datalist = utils.load_datalist(self.datalist_filepath)
+        self.valid_files.update(f for f in self._datalist['file']
+                                if storage.exists(f))
+        yield from zip(self._datalist['input_file'],
+                       self._datalist['file'],
+                       self._datalist['volume_0basedindex'])
+
+    def datalist(self) -> pd.DataFrame:
+        """Datalist of the rows, once rows() has been iterated
+
+        Discovered files are listed in the order they were found, and
+        saved to save_datalist if it was given.
+        """
+        if self.discovering:
+            self._datalist = utils.datalist_from_files(self._files)
+            if self.save_datalist:
+                utils.save_datalist(self._datalist, self.save_datalist)
+        return self._datalist
+
+    def load(self) -> pd.DataFrame:
+        """Read the datalist again, or find the files again, e.g. for
+        --watch to poll"""
+        if self.discovering:
+            return utils.datalist_from_files(list(
+                iter_nii_files(self.input_dirs, self.input_globs)))
+        return utils.load_datalist(self.datalist_filepath)
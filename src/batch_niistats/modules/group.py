@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Functions for voxelwise group summary images (mean and standard
+    deviation maps across all images in a datalist). Images are streamed
+    through a running accumulator, so memory use does not grow with the
+    number of images.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import concurrent.futures
+import nibabel as nb
+import numpy as np
+import pandas as pd
+from batch_niistats.modules import nii
+
+
+class VoxelwiseAccumulator:
+    """Running voxelwise count, mean and sum of squared deviations
+
+    Uses Welford's algorithm, so each image is added in one pass and only
+    three volumes are kept in memory. Accumulators filled from different
+    parts of a datalist can be combined with merge.
+
+    If omit_zeros is True, zero voxels of an image are not counted at that
+    voxel, so each voxel has its own count. If shape and affine are given,
+    every image has to match them; otherwise the first image sets them.
+    """
+
+    def __init__(self,
+                 omit_zeros: bool = False,
+                 shape: tuple[int, ...] | None = None,
+                 affine: np.ndarray | None = None):
+        self.omit_zeros = omit_zeros
+        self.shape = None if shape is None else tuple(shape)
+        self.affine = affine
+        self.count = None
+        self._mean = None
+        self._m2 = None
+
+    def _start(self, shape: tuple[int, ...], affine: np.ndarray):
+        self.shape = shape
+        self.affine = affine
+        self.count = np.zeros(shape, dtype=np.int64)
+        self._mean = np.zeros(shape, dtype=np.float64)
+        self._m2 = np.zeros(shape, dtype=np.float64)
+
+    def check_match(self,
+                    shape: tuple[int, ...],
+                    affine: np.ndarray,
+                    label: str = "image"):
+        """Raise ValueError if shape or affine differ from earlier images"""
+        if self.shape is None:
+            return
+        if tuple(shape) != tuple(self.shape):
+            raise ValueError(f"{label} has shape {tuple(shape)}, "
+                             f"expected {tuple(self.shape)}")
+        if not np.allclose(affine, self.affine, atol=1e-4):
+            raise ValueError(f"{label} has a different affine than the "
+                             "first image")
+
+    def update(self,
+               nii_array: np.ndarray,
+               affine: np.ndarray,
+               label: str = "image"):
+        """Add one 3D image to the running statistics"""
+        self.check_match(nii_array.shape, affine, label)
+        if self.count is None:
+            self._start(nii_array.shape, affine)
+
+        if self.omit_zeros:
+            mask = nii_array != 0
+            self.count += mask
+            delta = np.where(mask, nii_array - self._mean, 0)
+            self._mean += np.divide(delta, self.count,
+                                    out=np.zeros_like(delta),
+                                    where=self.count > 0)
+        else:
+            self.count += 1
+            delta = nii_array - self._mean
+            self._mean += delta / self.count
+        self._m2 += delta * (nii_array - self._mean)
+
+    def merge(self, other: "VoxelwiseAccumulator") -> "VoxelwiseAccumulator":
+        """Combine another accumulator into this one and return self
+
+        Uses the pairwise update of Chan et al., so the result is the same
+        (up to rounding) as adding all images to a single accumulator.
+        """
+        if other.count is None:
+            return self
+        self.check_match(other.shape, other.affine, "merged accumulator")
+        if self.count is None:
+            self._start(other.shape, other.affine)
+
+        count = self.count + other.count
+        delta = other._mean - self._mean
+        weight = np.divide(other.count, count,
+                           out=np.zeros(self.shape), where=count > 0)
+        self._mean += delta * weight
+        self._m2 += other._m2 + delta ** 2 * self.count * weight
+        self.count = count
+        return self
+
+    def mean(self) -> np.ndarray:
+        """Voxelwise mean, NaN where no image was counted"""
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    def sd(self, ddof: int = 0) -> np.ndarray:
+        """Voxelwise standard deviation, NaN where count <= ddof
+
+        ddof=0 matches the per-image sd calculated by nii.sd_nii.
+        """
+        variance = np.divide(self._m2, self.count - ddof,
+                             out=np.full(self.shape, np.nan),
+                             where=self.count > ddof)
+        return np.sqrt(variance)
+
+
+def reference_grid(rows: list[tuple],
+                   valid_files: set[str]
+                   ) -> tuple[tuple[int, ...] | None, np.ndarray | None]:
+    """Shape and affine of the first image in rows that can be opened
+
+    Read from the header only. Returns (None, None) if no image can be
+    opened.
+    """
+    for _, nii_file, _ in rows:
+        if nii_file not in valid_files:
+            continue
+        try:
+            img_proxy = nii.open_nii(nii_file)
+        except Exception:
+            continue
+        return img_proxy.shape[:3], img_proxy.affine
+    return None, None
+
+
+def add_image(accumulator: VoxelwiseAccumulator,
+              nii_file: str,
+              nii_volume: int) -> str:
+    """Add one volume to accumulator, returns the note for its row
+
+    Unreadable images and images whose shape or affine don't match the
+    accumulator are skipped.
+    """
+    try:
+        img_proxy = nii.open_nii(nii_file)
+        nii_array = nii.get_volume(img_proxy, nii_volume)
+    except Exception as e:
+        print(f"Error processing {nii_file}: {e}")
+        return f"error: {e}"
+
+    try:
+        accumulator.check_match(nii_array.shape, img_proxy.affine, nii_file)
+    except ValueError as e:
+        print(f"Skipping {nii_file}: {e}")
+        return 'error: shape/affine mismatch'
+
+    accumulator.update(nii_array, img_proxy.affine, nii_file)
+    return 'included in group maps'
+
+
+def accumulate_rows(rows: list[tuple],
+                    omit_zeros: bool,
+                    valid_files: set[str],
+                    shape: tuple[int, ...] | None = None,
+                    affine: np.ndarray | None = None
+                    ) -> tuple[VoxelwiseAccumulator, list[dict]]:
+    """Add the volumes in rows to a new accumulator, one at a time
+
+    Rows are (input_file, file, volume) tuples. Returns the accumulator
+    and one dictionary per row noting whether it was included. Missing
+    files, unreadable images and images that don't match shape and affine
+    (or the first image, if not given) are skipped.
+    """
+    accumulator = VoxelwiseAccumulator(omit_zeros, shape, affine)
+    list_of_notes = []
+
+    for nii_rawinput, nii_file, nii_volume in rows:
+        if nii_file not in valid_files:
+            print(f"File not found: {nii_file}")
+            note = 'file not found'
+        else:
+            note = add_image(accumulator, nii_file, nii_volume)
+
+        list_of_notes.append({'input_file': nii_rawinput,
+                              'filename': nii_file,
+                              'volume_0basedindex': nii_volume,
+                              'note': note})
+
+    return accumulator, list_of_notes
+
+
+def group_maps(datalist: pd.DataFrame,
+               inputs: dict[str, bool | str],
+               valid_files: set[str],
+               workers: int | None = None
+               ) -> tuple[VoxelwiseAccumulator, list[dict]]:
+    """Calculate voxelwise group statistics across all rows of a datalist
+
+    Rows are split into one shard per worker; each worker streams its
+    shard through its own accumulator and the shards are merged at the
+    end, in shard order. Every image has to match the shape and affine of
+    the first readable image in the datalist; others are skipped and
+    noted. Returns the merged accumulator and one note per datalist row,
+    in datalist order.
+    """
+    rows = list(zip(datalist['input_file'],
+                    datalist['file'],
+                    datalist['volume_0basedindex']))
+    shape, affine = reference_grid(rows, valid_files)
+    n_shards = max(1, min(workers or 4, len(rows)))
+    shards = [rows[shard::n_shards] for shard in range(n_shards)]
+
+    with concurrent.futures.ThreadPoolExecutor(n_shards) as executor:
+        shard_results = list(executor.map(
+            lambda shard: accumulate_rows(shard,
+                                          inputs['omit_zeros'],
+                                          valid_files,
+                                          shape,
+                                          affine),
+            shards))
+
+    accumulator = VoxelwiseAccumulator(inputs['omit_zeros'], shape, affine)
+    list_of_notes = [None] * len(rows)
+    for shard, (shard_accumulator, shard_notes) in enumerate(shard_results):
+        accumulator.merge(shard_accumulator)
+        list_of_notes[shard::n_shards] = shard_notes
+
+    return accumulator, list_of_notes
+
+
+def save_group_maps(accumulator: VoxelwiseAccumulator,
+                    output_prefix: str) -> dict[str, str]:
+    """Save mean, sd and count maps as .nii.gz files, returns their paths"""
+    if accumulator.count is None:
+        raise ValueError("No images were included, cannot save group maps")
+
+    maps = {'mean': accumulator.mean(),
+            'sd': accumulator.sd(),
+            'count': accumulator.count}
+    output_paths = {}
+    for name, data_array in maps.items():
+        output_paths[name] = f"{output_prefix}_group_{name}.nii.gz"
+        dtype = np.int32 if name == 'count' else np.float32
+        nb.save(nb.Nifti1Image(data_array.astype(dtype), accumulator.affine),
+                output_paths[name])
+        print(f"Group {name} map saved to file:\n{output_paths[name]}\n")
+
+    return output_paths
@@ -9,22 +9,369 @@
     CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
 """
 
+from collections.abc import Iterator
+import concurrent.futures
+import gzip
+import math
+import os
+import threading
+import zlib
 import nibabel as nb
+from nibabel.fileslice import fileslice
+from nibabel.openers import ImageOpener
+from nibabel.volumeutils import apply_read_scaling
 import numpy as np
+from batch_niistats.modules import cache, storage
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# largest block of a 4D file held in memory at once in whole-series mode
+SERIES_CHUNK_BYTES = 256 * 1024 ** 2
+
+# stored dtypes reduced exactly by the raw fast path, and the number of
+# voxels upcast at once: sums of uint16**2 over 2**20 voxels stay below
+# 2**53, so float64 sums of squares of a slab are exact integers
+RAW_DTYPES = (np.int8, np.uint8, np.int16, np.uint16)
+RAW_SLAB_VOXELS = 2 ** 20
+
+# volumes with at least this many voxels are reduced in slabs of
+# PARALLEL_SLAB_VOXELS on a shared pool, one thread per CPU
+PARALLEL_MIN_VOXELS = 2 ** 24
+PARALLEL_SLAB_VOXELS = 2 ** 22
+
+# --approx reads every APPROX_STEP-th row of each slice. 3 is the largest
+# step that keeps every estimate on the test images within 0.5%; larger
+# steps are faster but less accurate
+APPROX_STEP = 3
+
+# axes that can be profiled with --profile, in voxel (i, j, k) order
+PROFILE_AXES = {'x': 0, 'y': 1, 'z': 2}
+
+_slab_pool = None
+_slab_pool_lock = threading.Lock()
+
+
+def get_slab_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """Return the thread pool shared by all slab reductions"""
+    global _slab_pool
+    with _slab_pool_lock:
+        if _slab_pool is None:
+            _slab_pool = concurrent.futures.ThreadPoolExecutor(
+                os.cpu_count() or 1, thread_name_prefix='nii-slab')
+        return _slab_pool
+
+
+def open_nii(input_file: str,
+             raw_bytes: bytes | None = None,
+             **kwargs) -> nb.Nifti1Image:
+    """Open a .nii file with nibabel without reading its data.
+
+    If raw_bytes holds the contents of the file (already read from disk,
+    gzipped or not), the image is created from them instead of the file.
+    URLs (e.g. s3://bucket/file.nii) are opened through the storage
+    backends: uncompressed files are read in byte ranges, so only the
+    header and the volumes that are used are fetched, and gzipped files
+    are fetched in full. If the decompressed cache is turned on (see
+    cache.configure), local .nii.gz files are opened from their cached
+    uncompressed copy. Local paths may start with file://.
+    """
+    if raw_bytes is None and storage.is_url(input_file):
+        if str(input_file).endswith('.gz'):
+            raw_bytes = storage.read_bytes(input_file)
+        else:
+            return nb.Nifti1Image.from_stream(storage.RangeFile(input_file))
+
+    if raw_bytes is not None:
+        if raw_bytes[:2] == GZIP_MAGIC:
+            raw_bytes = gzip.decompress(raw_bytes)
+        return nb.Nifti1Image.from_bytes(raw_bytes)
+
+    local_file = storage.local_path(input_file)
+    cached = cache.open_cached(local_file)
+    if cached is None:
+        return nb.load(local_file, **kwargs)
+    # read from the open cache entry, which survives being evicted
+    image = nb.fileholders.FileHolder(cached.name, cached)
+    return nb.Nifti1Image.from_file_map({'image': image, 'header': image},
+                                        **kwargs)
+
+
+def read_nii_bytes(input_file: str) -> bytes:
+    """Read the raw (possibly gzipped) contents of a .nii file."""
+    if storage.is_url(input_file):
+        return storage.read_bytes(input_file)
+    local_file = storage.local_path(input_file)
+    with cache.open_cached(local_file) or open(local_file, 'rb') as f:
+        return f.read()
+
+
+def try_read_nii_bytes(input_file: str,
+                       valid_files: set[str]) -> bytes | None:
+    """Read the raw contents of a .nii file ahead of calculation
+
+    Returns None if the file is missing or can't be read. It is then
+    opened again by single_nii_calc, which reports the problem.
+    """
+    if input_file not in valid_files:
+        return None
+    try:
+        return read_nii_bytes(input_file)
+    except OSError:
+        return None
 
 
 def load_nii(
         input_file: str,
-        nii_volume: int
+        nii_volume: int,
+        raw_bytes: bytes | None = None
         ) -> np.ndarray:
     """Use nibabel to load a volume of .nii file, returns 3D NumPy array."""
-    img_proxy = nb.load(input_file)
-    data_array = np.asarray(img_proxy.get_fdata())
+    return get_volume(open_nii(input_file, raw_bytes), nii_volume)
+
+
+def get_volume(
+        img_proxy: nb.Nifti1Image,
+        nii_volume: int
+        ) -> np.ndarray:
+    """Read one volume of an opened .nii image, returns 3D NumPy array.
+
+    For 4D images only the requested volume is read from the file.
+    """
+    if len(img_proxy.shape) == 4:
+        return np.asarray(img_proxy.dataobj[..., nii_volume],
+                          dtype=np.float64)
+
+    return np.asarray(img_proxy.get_fdata())
+
+
+def get_raw_volume(
+        img_proxy: nb.Nifti1Image,
+        nii_volume: int
+        ) -> tuple[np.ndarray, float, float] | None:
+    """Read one volume as stored on disk, without applying scl_slope/inter
+
+    Returns (raw 3D array, slope, intercept), or None if the image isn't
+    stored as a small integer type (see RAW_DTYPES), in which case
+    get_volume should be used instead.
+    """
+    proxy = img_proxy.dataobj
+    if not nb.is_proxy(proxy) or \
+            img_proxy.get_data_dtype().type not in RAW_DTYPES:
+        return None
+
+    if len(proxy.shape) == 4:
+        # read only this volume's bytes, from a local file or a stream
+        with ImageOpener(proxy.file_like) as fileobj:
+            raw_array = fileslice(fileobj, (..., nii_volume), proxy.shape,
+                                  proxy.dtype, proxy.offset, proxy.order)
+    else:
+        raw_array = np.asanyarray(proxy.get_unscaled())
+
+    return raw_array, proxy.slope, proxy.inter
+
+
+def raw_zero_value(
+        raw_dtype: np.dtype,
+        slope: float,
+        inter: float
+        ) -> int | None:
+    """Return the stored value that becomes exactly 0 after scaling
+
+    Returns None if no value of raw_dtype scales to 0. Scaling is done the
+    same way as nibabel's get_fdata, so the same voxels count as zero.
+    """
+    info = np.iinfo(raw_dtype)
+    guess = -inter / slope
+    for candidate in {math.floor(guess), math.ceil(guess)}:
+        if info.min <= candidate <= info.max and apply_read_scaling(
+                np.array([candidate], dtype=raw_dtype), slope, inter)[0] == 0:
+            return candidate
+    return None
+
+
+def raw_moments(
+        raw_array: np.ndarray,
+        exclude: int | None = None,
+        squares: bool = True
+        ) -> tuple[int, int, int]:
+    """Count, sum and sum of squares of an integer array, exactly
+
+    Works through the array in slabs of at most RAW_SLAB_VOXELS voxels
+    along its last axis, so only one slab is upcast at a time. Voxels equal
+    to exclude are left out. If squares is False, the sum of squares is
+    skipped and returned as 0. Returns python ints.
+    """
+    slab_size = max(1, RAW_SLAB_VOXELS // math.prod(raw_array.shape[:-1]))
+    slabs = [raw_array[..., start:start + slab_size]
+             for start in range(0, raw_array.shape[-1], slab_size)]
+    if raw_array.size >= PARALLEL_MIN_VOXELS and len(slabs) > 1:
+        # integer sums are exact, so the slabs can be added in any order
+        moments = get_slab_pool().map(
+            lambda slab: raw_slab_moments(slab, exclude, squares), slabs)
+    else:
+        moments = (raw_slab_moments(slab, exclude, squares)
+                   for slab in slabs)
 
-    if data_array.ndim == 4:
-        data_array = data_array[..., nii_volume]  # get only first volume
+    n, total, total_sq = 0, 0, 0
+    for slab_n, slab_total, slab_total_sq in moments:
+        n += slab_n
+        total += slab_total
+        total_sq += slab_total_sq
 
-    return data_array
+    return n, total, total_sq
+
+
+def raw_slab_moments(
+        slab: np.ndarray,
+        exclude: int | None,
+        squares: bool
+        ) -> tuple[int, int, int]:
+    """Count, sum and sum of squares of one slab for raw_moments"""
+    n, total, total_sq = slab.size, 0, 0
+    if exclude is not None:
+        n_excluded = int(np.count_nonzero(slab == exclude))
+        n -= n_excluded
+        total -= n_excluded * int(exclude)
+        total_sq -= n_excluded * int(exclude) ** 2 if squares else 0
+    total += int(slab.sum(dtype=np.int64))
+    if squares:
+        slab = slab.astype(np.float64).ravel(order='K')
+        total_sq += int(np.dot(slab, slab))
+
+    return n, total, total_sq
+
+
+def calc_raw_stat(
+        raw_volume: tuple[np.ndarray, float, float],
+        inputs: dict[str, bool | str]
+        ) -> float:
+    """Calculate the requested statistic from a volume as stored on disk
+
+    Reduces over the raw integers and converts the result analytically:
+    mean = slope * raw mean + inter, sd = |slope| * raw sd. Gives the same
+    values as calc_nii_stat on the scaled volume, without making a float
+    copy of it. If omit_zeros is True, the stored value that scales to 0
+    is excluded.
+    """
+    raw_array, slope, inter = raw_volume
+    exclude = None
+    if inputs['omit_zeros']:
+        exclude = raw_zero_value(raw_array.dtype, slope, inter)
+    n, total, total_sq = raw_moments(raw_array,
+                                     exclude,
+                                     squares=inputs['statistic'] == 'sd')
+    if n == 0:
+        return np.nan
+
+    if inputs['statistic'] == 'mean':
+        return float(slope * (total / n) + inter)
+    elif inputs['statistic'] == 'sd':
+        return float(abs(slope) * math.sqrt((n * total_sq - total ** 2)
+                                            / n ** 2))
+
+
+def iter_nii_series(
+        input_file: str,
+        chunk_bytes: int = SERIES_CHUNK_BYTES
+        ) -> Iterator[tuple[int, np.ndarray]]:
+    """Read all volumes of a .nii file in chunks along time
+
+    Yields (index of first volume in chunk, 4D NumPy array) so that every
+    volume is read exactly once. Chunks hold as many volumes as fit in
+    chunk_bytes (as float64), at least one. A 3D file is a single chunk
+    with one volume.
+    """
+    img_proxy = open_nii(input_file, keep_file_open=True)
+    if len(img_proxy.shape) == 3:
+        yield 0, np.asarray(img_proxy.dataobj)[..., np.newaxis]
+        return
+
+    n_volumes = img_proxy.shape[3]
+    volume_bytes = math.prod(img_proxy.shape[:3]) * 8
+    step = max(1, chunk_bytes // volume_bytes)
+    for start in range(0, n_volumes, step):
+        yield start, np.asarray(img_proxy.dataobj[..., start:start + step])
+
+
+def series_stat(
+        data_array: np.ndarray,
+        inputs: dict[str, bool | str]
+        ) -> np.ndarray:
+    """Calculate the requested statistic for every volume of a 4D array
+
+    Reduces over the three spatial axes at once and returns a 1D array
+    with one value per volume. If omit_zeros is True, only nonzero voxels
+    of each volume are included.
+    """
+    spatial_axes = (0, 1, 2)
+    where = data_array != 0 if inputs['omit_zeros'] else True
+
+    if inputs['statistic'] == 'mean':
+        return np.mean(data_array, axis=spatial_axes,
+                       dtype=np.float64, where=where)
+    elif inputs['statistic'] == 'sd':
+        return np.std(data_array, axis=spatial_axes,
+                      dtype=np.float64, where=where)
+
+
+def slab_moments(
+        slab: np.ndarray,
+        omit_zeros: bool,
+        m2: bool = True
+        ) -> tuple[int, float, float]:
+    """Count, mean and sum of squared deviations (M2) of a 1D slab
+
+    If omit_zeros is True, only nonzero voxels are included. If m2 is
+    False, M2 is skipped and returned as 0. Sums are done in float64.
+    """
+    values = slab[slab != 0] if omit_zeros else slab
+    n = values.size
+    if n == 0:
+        return 0, 0.0, 0.0
+    mean = float(values.mean(dtype=np.float64))
+    if not m2:
+        return n, mean, 0.0
+    deviations = np.subtract(values, mean, dtype=np.float64)
+    return n, mean, float(np.dot(deviations, deviations))
+
+
+def combine_moments(
+        a: tuple[int, float, float],
+        b: tuple[int, float, float]
+        ) -> tuple[int, float, float]:
+    """Merge the (count, mean, M2) of two slabs (Chan et al.)"""
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    return (n,
+            mean_a + delta * n_b / n,
+            m2_a + m2_b + delta ** 2 * n_a * n_b / n)
+
+
+def parallel_moments(
+        nii_array: np.ndarray,
+        omit_zeros: bool,
+        m2: bool = True
+        ) -> tuple[int, float, float]:
+    """Count, mean and M2 of a large array, reduced in parallel slabs
+
+    The array is split into slabs of PARALLEL_SLAB_VOXELS voxels (views,
+    in memory order) that are reduced on the shared slab pool. Slab
+    results are merged in slab order, so the result doesn't depend on
+    which thread finishes first.
+    """
+    flat = nii_array.ravel(order='K')
+    slabs = [flat[start:start + PARALLEL_SLAB_VOXELS]
+             for start in range(0, flat.size, PARALLEL_SLAB_VOXELS)]
+    moments = (0, 0.0, 0.0)
+    for slab_moment in get_slab_pool().map(
+            lambda slab: slab_moments(slab, omit_zeros, m2), slabs):
+        moments = combine_moments(moments, slab_moment)
+
+    return moments
 
 
 def mean_nii(
@@ -34,7 +381,11 @@ def mean_nii(
     """Calculate mean of a 3D NumPy array, return single number
 
     If omit_zeros is True, only nonzero voxels are included in calculation.
+    Arrays of at least PARALLEL_MIN_VOXELS voxels are reduced in parallel.
     """
+    if nii_array.size >= PARALLEL_MIN_VOXELS:
+        n, mean, _ = parallel_moments(nii_array, omit_zeros, m2=False)
+        return mean if n else np.nan
 
     return nii_array[nii_array != 0].mean() if omit_zeros else nii_array.mean()
 
@@ -46,20 +397,153 @@ def sd_nii(
     """Calculate the standard deviation of a 3D NumPy array, return float
 
     If omit_zeros is True, only nonzero voxels are included in sd calculation.
+    Arrays of at least PARALLEL_MIN_VOXELS voxels are reduced in parallel.
     """
+    if data_array.size >= PARALLEL_MIN_VOXELS:
+        n, _, m2 = parallel_moments(data_array, omit_zeros)
+        return math.sqrt(m2 / n) if n else np.nan
 
     return data_array[data_array != 0].std() if omit_zeros else data_array.std()
 
 
+def profile_stats(
+        nii_array: np.ndarray,
+        axis: str,
+        omit_zeros: bool
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """Mean and sd of every slice of a 3D NumPy array along one axis
+
+    axis is 'x', 'y' or 'z'. Counts, sums and squared deviations are each
+    one NumPy reduction over the other two axes. If omit_zeros is True,
+    only nonzero voxels are included; slices without any are NaN. Returns
+    two 1D arrays with one value per slice.
+    """
+    other_axes = tuple(a for a in range(3) if a != PROFILE_AXES[axis])
+    if omit_zeros:
+        where = nii_array != 0
+        counts = np.count_nonzero(where, axis=other_axes, keepdims=True)
+    else:
+        where = True
+        counts = math.prod(nii_array.shape[a] for a in other_axes)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.sum(nii_array, axis=other_axes, dtype=np.float64,
+                       where=where, keepdims=True) / counts
+        deviations = np.subtract(nii_array, means, dtype=np.float64)
+        variances = np.sum(np.square(deviations), axis=other_axes,
+                           where=where, keepdims=True) / counts
+    return means.squeeze(other_axes), np.sqrt(variances).squeeze(other_axes)
+
+
+def approx_start(nii_file: str, step: int) -> int:
+    """Offset of the --approx sample: fixed for a file name, but different
+    between files so that samples don't line up with the same anatomy"""
+    return zlib.crc32(os.path.basename(str(nii_file)).encode()) % step
+
+
+def approx_moments(
+        nii_array: np.ndarray,
+        step: int,
+        start: int,
+        exclude: float | None = None
+        ) -> np.ndarray:
+    """Count, sum and sum of squares of a systematic sample of a 3D array
+
+    In every slice along the third axis, every step-th row along the
+    second axis is read, starting at row (start + slice) % step, so the
+    sample is a diagonal lattice that covers every slice. Voxels equal to
+    exclude are left out. All rows are gathered with one index operation
+    and reduced together; sums are centred on the sample mean for
+    precision. Returns a (slices + 1, 3) float64 array: the count, sum and
+    sum of squares of the sample in each slice, then a row holding the
+    centre.
+    """
+    n_rows, n_slices = nii_array.shape[1:3]
+    first_rows = (start + np.arange(n_slices)) % step
+    positions = np.arange(-(-n_rows // step))
+    row_index = first_rows[:, np.newaxis] + step * positions[np.newaxis, :]
+    in_volume = row_index < n_rows
+    slice_index = np.broadcast_to(np.arange(n_slices)[:, np.newaxis],
+                                  row_index.shape)[in_volume]
+
+    sample = np.asarray(nii_array[:, row_index[in_volume], slice_index],
+                        dtype=np.float64)
+    if exclude is None:
+        where = np.ones(sample.shape, bool)
+    else:
+        where = sample != exclude
+    moments = np.zeros((n_slices + 1, 3))
+    if not where.any():
+        return moments
+
+    centre = np.mean(sample, where=where)
+    sample -= centre
+    moments[:n_slices, 0] = np.bincount(slice_index,
+                                        np.count_nonzero(where, axis=0),
+                                        n_slices)
+    moments[:n_slices, 1] = np.bincount(slice_index,
+                                        np.sum(sample, axis=0, where=where),
+                                        n_slices)
+    moments[:n_slices, 2] = np.bincount(
+        slice_index, np.sum(np.square(sample), axis=0, where=where),
+        n_slices)
+    moments[n_slices] = centre
+    return moments
+
+
+def approx_stat(
+        moments: np.ndarray,
+        inputs: dict[str, bool | str],
+        step: int
+        ) -> tuple[float, float]:
+    """Estimate a statistic from approx_moments, with its standard error
+
+    The estimate pools all slices. Its error comes mostly from where the
+    lattice falls in each slice, which shifts by one row from slice to
+    slice, so the standard error is estimated from the second differences
+    between neighbouring slices of each slice's contribution to the
+    estimate (linearised), which removes smooth changes in anatomy. A
+    finite population correction for sampling 1 in step rows makes it 0
+    when every row is read. Returns (estimate, standard error).
+    """
+    centre = moments[-1, 0]
+    counts, sums, squares = moments[:-1].T
+    n = counts.sum()
+    if n == 0:
+        return np.nan, np.nan
+
+    mean = sums.sum() / n
+    if inputs['statistic'] == 'mean':
+        value = centre + mean
+        contributions = sums - mean * counts
+        scale = 1.0
+    else:
+        variance = max(squares.sum() / n - mean ** 2, 0)
+        value = math.sqrt(variance)
+        contributions = (squares - 2 * mean * sums + mean ** 2 * counts -
+                         variance * counts)
+        scale = 1 / (2 * value) if value > 0 else 0.0
+
+    if len(contributions) < 3:
+        return float(value), np.nan
+    second_differences = np.diff(contributions, 2)
+    total_variance = (len(contributions) *
+                      np.mean(np.square(second_differences)) / 6)
+    se = scale * math.sqrt((1 - 1 / step) * total_variance) / n
+    return float(value), float(se)
+
+
 def try_single_nii_calc(nii_rawinput: str,
                         nii_file: str,
                         nii_volume: int,
                         inputs: dict[str, bool | str],
-                        valid_files: set[str]
+                        valid_files: set[str],
+                        **kwargs
                         ) -> dict[str, str | int | float] | None:
     """Safely call single_nii_calc with error handling.
 
     Returns None if there is an exception. Returns dictionary otherwise.
+    Keyword arguments are passed on to single_nii_calc.
     """
     try:
         return single_nii_calc(
@@ -67,47 +551,287 @@ def try_single_nii_calc(nii_rawinput: str,
             nii_file,
             nii_volume,
             inputs,
-            valid_files
+            valid_files,
+            **kwargs
             )
     except Exception as e:
         print(f"Error processing {nii_file}: {e}")
         return None
 
 
+def stat_label(inputs: dict[str, bool | str]) -> str:
+    """Return the output column header for a parsed input option."""
+    omit_flag = 'nonzero' if inputs['omit_zeros'] else 'all'
+    return f"{inputs['statistic']} of {omit_flag} voxels"
+
+
+def calc_nii_stat(nii_array: np.ndarray,
+                  inputs: dict[str, bool | str]
+                  ) -> float:
+    """Calculate the statistic requested in inputs on a 3D NumPy array."""
+    if inputs['statistic'] == 'mean':
+        return mean_nii(nii_array, inputs["omit_zeros"])
+    elif inputs['statistic'] == 'sd':
+        return sd_nii(nii_array, inputs["omit_zeros"])
+
+
 def single_nii_calc(nii_rawinput: str,
                     nii_file: str,
                     nii_volume: str,
                     inputs: dict[str, bool | str],
-                    valid_files: set[str]
+                    valid_files: set[str],
+                    raw_bytes: bytes | None = None
                     ) -> dict[str, str | int | float]:
     """Calculate statistics for a single .nii file, to be used with map
 
     This function calls the mean/sd functions for a single .nii file and
     returns the output as a dictionary to be converted to pandas data frame.
+    If the file was already read, pass its contents as raw_bytes.
     """
+    return multi_nii_calc(nii_rawinput,
+                          nii_file,
+                          nii_volume,
+                          [inputs],
+                          valid_files,
+                          raw_bytes)
 
-    # define label for output var (used as column header)
-    if inputs['omit_zeros']:
-        omit_flag = 'nonzero'
-    elif not inputs['omit_zeros']:
-        omit_flag = 'all'
+
+def multi_nii_calc(nii_rawinput: str,
+                   nii_file: str,
+                   nii_volume: int,
+                   list_of_inputs: list[dict[str, bool | str]],
+                   valid_files: set[str],
+                   raw_bytes: bytes | None = None
+                   ) -> dict[str, str | int | float]:
+    """Calculate several statistics for a single .nii file from one load
+
+    Same as single_nii_calc, but takes a list of parsed input options and
+    adds one output column per option. The volume is loaded only once.
+    """
 
     # Run calculation only if the file exists
     if nii_file in valid_files:
-        nii_array = load_nii(nii_file, nii_volume)
+        img_proxy = open_nii(nii_file, raw_bytes)
         filestatus = 'file exists'
 
-        if inputs['statistic'] == 'mean':
-            output_val = mean_nii(nii_array, inputs["omit_zeros"])
-        elif inputs['statistic'] == 'sd':
-            output_val = sd_nii(nii_array, inputs["omit_zeros"])
+        # integer data: reduce stored values, skipping the float copy
+        raw_volume = get_raw_volume(img_proxy, nii_volume)
+        if raw_volume is not None:
+            output_vals = [calc_raw_stat(raw_volume, inputs)
+                           for inputs in list_of_inputs]
+        else:
+            nii_array = get_volume(img_proxy, nii_volume)
+            output_vals = [calc_nii_stat(nii_array, inputs)
+                           for inputs in list_of_inputs]
     else:
         print(f"File not found: {nii_file}")
         filestatus = 'file not found'
-        output_val = None
+        output_vals = [None] * len(list_of_inputs)
+
+    output = {'input_file': nii_rawinput,
+              'filename': nii_file,
+              'volume_0basedindex': nii_volume}
+    for inputs, output_val in zip(list_of_inputs, output_vals):
+        output[stat_label(inputs)] = output_val
+    output['note'] = filestatus
+
+    return output
+
+
+def try_series_nii_calc(nii_rawinput: str,
+                        nii_file: str,
+                        inputs: dict[str, bool | str],
+                        valid_files: set[str]
+                        ) -> list[dict[str, str | int | float]]:
+    """Safely call series_nii_calc with error handling.
+
+    Returns an empty list if there is an exception.
+    """
+    try:
+        return series_nii_calc(
+            nii_rawinput,
+            nii_file,
+            inputs,
+            valid_files
+            )
+    except Exception as e:
+        print(f"Error processing {nii_file}: {e}")
+        return []
+
+
+def series_nii_calc(nii_rawinput: str,
+                    nii_file: str,
+                    inputs: dict[str, bool | str],
+                    valid_files: set[str]
+                    ) -> list[dict[str, str | int | float]]:
+    """Calculate statistics for every volume of a single .nii file
+
+    Reads the file once and returns one dictionary per volume, in the same
+    format as single_nii_calc.
+    """
+    label = stat_label(inputs)
+
+    if nii_file not in valid_files:
+        print(f"File not found: {nii_file}")
+        return [{'input_file': nii_rawinput,
+                 'filename': nii_file,
+                 'volume_0basedindex': None,
+                 label: None,
+                 'note': 'file not found'}]
+
+    output = []
+    for start, data_array in iter_nii_series(nii_file):
+        for offset, output_val in enumerate(series_stat(data_array, inputs)):
+            output.append({'input_file': nii_rawinput,
+                           'filename': nii_file,
+                           'volume_0basedindex': start + offset,
+                           label: float(output_val),
+                           'note': 'file exists'})
+    return output
+
+
+def try_profile_nii_calc(nii_rawinput: str,
+                         nii_file: str,
+                         nii_volume: int,
+                         axes: tuple[str, ...],
+                         omit_zeros: bool,
+                         valid_files: set[str]
+                         ) -> list[dict[str, str | int | float]]:
+    """Safely call profile_nii_calc with error handling.
+
+    Returns an empty list if there is an exception.
+    """
+    try:
+        return profile_nii_calc(
+            nii_rawinput,
+            nii_file,
+            nii_volume,
+            axes,
+            omit_zeros,
+            valid_files
+            )
+    except Exception as e:
+        print(f"Error processing {nii_file}: {e}")
+        return []
+
+
+def profile_nii_calc(nii_rawinput: str,
+                     nii_file: str,
+                     nii_volume: int,
+                     axes: tuple[str, ...],
+                     omit_zeros: bool,
+                     valid_files: set[str]
+                     ) -> list[dict[str, str | int | float]]:
+    """Calculate mean and sd of every slice along each of axes
+
+    Loads the volume once and returns one dictionary per slice (long
+    format), with the axis and 0-based slice index, in the same format
+    as single_nii_calc otherwise.
+    """
+    mean_label = stat_label({'statistic': 'mean', 'omit_zeros': omit_zeros})
+    sd_label = stat_label({'statistic': 'sd', 'omit_zeros': omit_zeros})
+
+    if nii_file not in valid_files:
+        print(f"File not found: {nii_file}")
+        return [{'input_file': nii_rawinput,
+                 'filename': nii_file,
+                 'volume_0basedindex': nii_volume,
+                 'axis': None,
+                 'slice_0basedindex': None,
+                 mean_label: None,
+                 sd_label: None,
+                 'note': 'file not found'}]
+
+    nii_array = load_nii(nii_file, nii_volume)
+    output = []
+    for axis in axes:
+        means, sds = profile_stats(nii_array, axis, omit_zeros)
+        for index, (mean, sd) in enumerate(zip(means, sds)):
+            output.append({'input_file': nii_rawinput,
+                           'filename': nii_file,
+                           'volume_0basedindex': nii_volume,
+                           'axis': axis,
+                           'slice_0basedindex': index,
+                           mean_label: float(mean),
+                           sd_label: float(sd),
+                           'note': 'file exists'})
+    return output
+
+
+def try_approx_nii_calc(nii_rawinput: str,
+                        nii_file: str,
+                        nii_volume: int,
+                        inputs: dict[str, bool | str],
+                        valid_files: set[str],
+                        step: int = APPROX_STEP
+                        ) -> dict[str, str | int | float] | None:
+    """Safely call approx_nii_calc with error handling.
+
+    Returns None if there is an exception. Returns dictionary otherwise.
+    """
+    try:
+        return approx_nii_calc(
+            nii_rawinput,
+            nii_file,
+            nii_volume,
+            inputs,
+            valid_files,
+            step
+            )
+    except Exception as e:
+        print(f"Error processing {nii_file}: {e}")
+        return None
+
+
+def approx_nii_calc(nii_rawinput: str,
+                    nii_file: str,
+                    nii_volume: int,
+                    inputs: dict[str, bool | str],
+                    valid_files: set[str],
+                    step: int = APPROX_STEP
+                    ) -> dict[str, str | int | float]:
+    """Estimate statistics for a single .nii file from every step-th row
+    of each slice
+
+    Same output as single_nii_calc, plus a 'standard error of ...' column
+    for the estimate (see approx_moments and approx_stat). Integer images
+    are sampled as stored on disk and scl_slope/inter are applied to the
+    estimate, as in calc_raw_stat; other images are read through the
+    array proxy. Only the sampled rows are converted to float64.
+    """
+    label = stat_label(inputs)
+    output = {'input_file': nii_rawinput,
+              'filename': nii_file,
+              'volume_0basedindex': nii_volume}
+
+    if nii_file in valid_files:
+        img_proxy = open_nii(nii_file)
+        raw_volume = get_raw_volume(img_proxy, nii_volume)
+        if raw_volume is not None:
+            nii_array, slope, inter = raw_volume
+            exclude = raw_zero_value(nii_array.dtype, slope, inter)
+        else:
+            if len(img_proxy.shape) == 4:
+                nii_array = np.asanyarray(img_proxy.dataobj[..., nii_volume])
+            else:
+                nii_array = np.asanyarray(img_proxy.dataobj)
+            slope, inter, exclude = 1.0, 0.0, 0
+        moments = approx_moments(nii_array,
+                                 step,
+                                 approx_start(nii_file, step),
+                                 exclude if inputs['omit_zeros'] else None)
+        value, se = approx_stat(moments, inputs, step)
+        if inputs['statistic'] == 'mean':
+            value = slope * value + inter
+        else:
+            value = abs(slope) * value
+        output[label] = float(value)
+        output[f"standard error of {label}"] = float(abs(slope) * se)
+        output['note'] = 'file exists'
+    else:
+        print(f"File not found: {nii_file}")
+        output[label] = None
+        output[f"standard error of {label}"] = None
+        output['note'] = 'file not found'
 
-    return {'input_file': nii_rawinput,
-            'filename': nii_file,
-            'volume_0basedindex': nii_volume,
-            f"{inputs['statistic']} of {omit_flag} voxels": output_val,
-            'note': filestatus}
+    return output
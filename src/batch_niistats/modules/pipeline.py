@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Staged read-ahead pipeline: one pool of workers reads raw file bytes
+    ahead of time while a separate pool decompresses and calculates, so
+    that slow storage and busy cores can overlap.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+from collections.abc import Callable, Iterable
+import concurrent.futures
+import os
+import threading
+
+
+def _submit_staged(item,
+                   read: Callable,
+                   compute: Callable,
+                   io_pool: concurrent.futures.Executor,
+                   compute_pool: concurrent.futures.Executor,
+                   slots: threading.BoundedSemaphore
+                   ) -> concurrent.futures.Future:
+    """Read item in io_pool, then compute on the result in compute_pool
+
+    Returns a future for the compute result. The slot taken by the caller
+    is released once the item is computed (or fails), so raw bytes are
+    only held for items in flight.
+    """
+    done = concurrent.futures.Future()
+
+    def on_compute(compute_future):
+        slots.release()
+        if compute_future.exception() is not None:
+            done.set_exception(compute_future.exception())
+        else:
+            done.set_result(compute_future.result())
+
+    def on_read(read_future):
+        try:
+            compute_future = compute_pool.submit(compute,
+                                                 item,
+                                                 read_future.result())
+        except BaseException as e:
+            slots.release()
+            done.set_exception(e)
+            return
+        compute_future.add_done_callback(on_compute)
+
+    io_pool.submit(read, item).add_done_callback(on_read)
+    return done
+
+
+def staged_map(read: Callable,
+               compute: Callable,
+               items: Iterable,
+               io_workers: int = 8,
+               compute_workers: int | None = None,
+               max_inflight: int | None = None
+               ) -> list:
+    """Run read(item) and then compute(item, read result) for every item
+
+    read runs in a pool of io_workers threads and compute in a separate
+    pool of compute_workers threads (default: number of CPUs). At most
+    max_inflight items (default: twice the total number of workers) are
+    read but not yet computed; once that many are waiting, reading pauses
+    until compute catches up, which bounds memory. Returns the compute
+    results in the same order as items. Exceptions are raised when the
+    results are collected.
+    """
+    compute_workers = compute_workers or os.cpu_count() or 1
+    max_inflight = max_inflight or 2 * (io_workers + compute_workers)
+    slots = threading.BoundedSemaphore(max_inflight)
+
+    with concurrent.futures.ThreadPoolExecutor(io_workers) as io_pool, \
+            concurrent.futures.ThreadPoolExecutor(
+                compute_workers) as compute_pool:
+        futures = []
+        for item in items:
+            slots.acquire()  # back-pressure: wait for a free slot
+            futures.append(_submit_staged(item, read, compute,
+                                          io_pool, compute_pool, slots))
+        return [future.result() for future in futures]
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Task ordering (--schedule cost): rows are started largest first, so
+    that one big file doesn't run alone at the end of a batch, and rows of
+    similar size are grouped by directory and inode so that files next to
+    each other on disk are read together. Results are put back in the
+    order of the datalist.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+from collections.abc import Callable, Sequence
+import concurrent.futures
+import math
+import os
+import nibabel as nb
+from batch_niistats.modules import storage
+
+# number of threads reading headers to estimate costs
+HEADER_WORKERS = 16
+
+
+def estimate_cost(nii_file: str,
+                  all_volumes: bool = False) -> int:
+    """Estimate how much work a row is, in bytes of image data
+
+    Read from the header only. Uncompressed files cost the bytes of one
+    volume (all volumes if all_volumes is True); gzipped files have to be
+    inflated up to the end, so they cost the whole series. URLs cost their
+    size in storage. Files that can't be read cost 0.
+    """
+    try:
+        if storage.is_url(nii_file):
+            filesystem, path = storage.get_filesystem(nii_file)
+            return int(filesystem.size(path))
+
+        header = nb.load(storage.local_path(nii_file)).header
+        shape = header.get_data_shape()
+        volume_bytes = math.prod(shape[:3]) * header.get_data_dtype().itemsize
+        if all_volumes or str(nii_file).endswith('.gz'):
+            return volume_bytes * math.prod(shape[3:])
+        return volume_bytes
+    except Exception:
+        return 0
+
+
+def locality_key(nii_file: str) -> tuple[str, int]:
+    """Directory and inode of a file, to read neighbouring files together"""
+    try:
+        inode = 0 if storage.is_url(nii_file) else \
+            os.stat(storage.local_path(nii_file)).st_ino
+    except OSError:
+        inode = 0
+    return os.path.dirname(str(nii_file)), inode
+
+
+def cost_order(rows: Sequence[tuple],
+               all_volumes: bool = False,
+               cost: Callable[[str, bool], int] = estimate_cost
+               ) -> list[int]:
+    """Return the row indices in the order they should be started
+
+    rows are (input_file, file, volume) tuples. Rows are sorted into size
+    tiers (powers of two of their estimated cost), largest tier first, and
+    within a tier by directory, inode and volume. Headers are read in
+    parallel, once per file.
+    """
+    files = list(dict.fromkeys(row[1] for row in rows))
+    with concurrent.futures.ThreadPoolExecutor(HEADER_WORKERS) as executor:
+        costs = dict(zip(files, executor.map(
+            lambda nii_file: cost(nii_file, all_volumes), files)))
+        localities = dict(zip(files, executor.map(locality_key, files)))
+
+    def sort_key(index):
+        nii_file, nii_volume = rows[index][1], rows[index][2]
+        tier = -int(costs[nii_file]).bit_length()
+        volume = 0 if nii_volume is None or nii_volume != nii_volume \
+            else int(nii_volume)
+        return tier, localities[nii_file], volume, index
+
+    return sorted(range(len(rows)), key=sort_key)
+
+
+def restore_order(results: Sequence, order: Sequence[int]) -> list:
+    """Put results computed in schedule order back in datalist order"""
+    ordered = [None] * len(order)
+    for index, result in zip(order, results):
+        ordered[index] = result
+    return ordered
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Persistent daemon (`batch_niistats serve`) that keeps the libraries
+    imported and a pool of worker threads running, and accepts batch jobs
+    over a Unix-domain socket. Jobs are sent with batch_niistats.client.
+    Rows of concurrent jobs share the pool fairly, taking turns job by
+    job, so a small job isn't stuck behind a large one.
+
+    Requests and responses are one line of JSON each:
+
+        {"command": "run", "input": "/data/datalist.csv", "option": "M",
+         "save": true}
+        {"ok": true, "output_path": "...", "table": {"columns": [...],
+         "data": [[...], ...]}}
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+from collections import deque
+from collections.abc import Callable, Iterable
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+from batch_niistats import client
+from batch_niistats.modules import api, cache, nii, storage, utils
+
+# Unix-domain sockets don't exist on Windows. The module still has to
+# import there, since the command line tool loads it; main() refuses to
+# serve instead.
+_UnixStreamServer = getattr(socketserver, "UnixStreamServer", object)
+
+
+class _Job:
+    """Rows of one request waiting for, or running on, the pool"""
+
+    def __init__(self, fn: Callable, items: list):
+        self.fn = fn
+        self.pending = deque(enumerate(items))
+        self.results = [None] * len(items)
+        self.remaining = len(items)
+        self.errors = {}
+
+
+class FairScheduler:
+    """Pool of worker threads shared round-robin between jobs
+
+    Each worker takes the next row of the next job in turn, so every job
+    that has rows waiting gets an equal share of the workers, whatever
+    the order and size of the jobs.
+    """
+
+    def __init__(self, workers: int | None = None):
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self._jobs = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work,
+                                          name=f"niistats-worker-{i}",
+                                          daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._jobs or self._closed)
+                if not self._jobs:
+                    return
+                job = self._jobs.popleft()
+                index, item = job.pending.popleft()
+                if job.pending:
+                    self._jobs.append(job)  # back of the line
+            try:
+                result = job.fn(item)
+            except BaseException as e:
+                result, job.errors[index] = None, e
+            with self._condition:
+                job.results[index] = result
+                job.remaining -= 1
+                if job.remaining == 0:
+                    self._condition.notify_all()
+
+    def map(self, fn: Callable, items: Iterable) -> list:
+        """Call fn on every item on the shared workers, results in order
+
+        Blocks until the job is done. If any call raised, the exception
+        of the first item that raised (in item order) is raised here after
+        the other rows finished.
+        """
+        job = _Job(fn, list(items))
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("scheduler is shut down")
+            if job.remaining:
+                self._jobs.append(job)
+                self._condition.notify_all()
+            self._condition.wait_for(lambda: job.remaining == 0)
+        if job.errors:
+            raise job.errors[min(job.errors)]
+        return job.results
+
+    def shutdown(self):
+        """Stop the workers once the rows already queued are done"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Read one JSON request, answer with one JSON response"""
+
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            response = self.server.respond(message)
+        except Exception as e:
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+class BatchServer(socketserver.ThreadingMixIn, _UnixStreamServer):
+    """Unix socket server running every job on one FairScheduler"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, workers: int | None = None):
+        self.socket_path = socket_path
+        self.scheduler = FairScheduler(workers)
+        super().__init__(socket_path, _RequestHandler)
+
+    def server_bind(self):
+        # jobs read and write any path the daemon's user can, so only that
+        # user may connect: create the socket with mode 0600
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def respond(self, message: dict) -> dict:
+        """Carry out one request and return the response"""
+        command = message.get("command", "run")
+        if command == "ping":
+            return {"ok": True}
+        if command == "shutdown":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"ok": True}
+        if command != "run":
+            raise ValueError(f"Unknown command: {command!r}")
+        return self.run_job(message["input"],
+                            message.get("option", "M"),
+                            message.get("save", False))
+
+    def run_job(self,
+                files_or_datalist: str | list[str],
+                option: str,
+                save: bool) -> dict:
+        """Calculate one datalist and return its output table
+
+        Gives the same table as the command line tool. If save is True and
+        a datalist .csv was given, the output .csv is also saved next to
+        it.
+        """
+        inputs = utils.parse_inputs(option)
+        if not inputs:
+            raise ValueError(f"Unsupported option: {option!r}. "
+                             "Use one of M, m, S, s.")
+        timestamp = utils.get_timestamp()
+        datalist = api.as_datalist(files_or_datalist)
+        valid_files = {f for f in datalist['file'] if storage.exists(f)}
+
+        list_of_data = self.scheduler.map(
+            lambda args: nii.try_single_nii_calc(args[0],
+                                                 args[1],
+                                                 args[2],
+                                                 inputs,
+                                                 valid_files),
+            api.row_tasks(datalist))
+        combined_df = utils.create_output_df(datalist, list_of_data)
+
+        output_path = None
+        if save and isinstance(files_or_datalist, str):
+            output_path = utils.write_output_df_path(files_or_datalist,
+                                                     option,
+                                                     timestamp)
+            utils.save_output_csv(combined_df, output_path)
+
+        return {"ok": True,
+                "output_path": output_path,
+                "table": json.loads(combined_df.to_json(orient="split",
+                                                        index=False))}
+
+    def server_close(self):
+        super().server_close()
+        self.scheduler.shutdown()
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+
+def remove_stale_socket(socket_path: str):
+    """Remove a socket file left by a daemon that is no longer running
+
+    Raises RuntimeError if a daemon is still answering on it.
+    """
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            os.remove(socket_path)
+            return
+    raise RuntimeError(f"A daemon is already running on {socket_path}")
+
+
+def main(argv: list[str] | None = None):
+    """Run the daemon until interrupted with Ctrl+C or a shutdown request"""
+    parser = argparse.ArgumentParser(
+        prog="batch_niistats serve",
+        description="Keep batch_niistats running with warm worker threads\n"
+        "and accept jobs from batch_niistats_client over a Unix\n"
+        "socket.",
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        "--socket",
+        default=client.DEFAULT_SOCKET,
+        metavar="PATH",
+        help=f"Socket to listen on (default: {client.DEFAULT_SOCKET}).")
+    parser.add_argument(
+        "--workers",
+        type=utils.parse_positive_int,
+        metavar="N",
+        help="Number of worker threads shared by all jobs (default:\n"
+        "chosen by python).")
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Keep uncompressed copies of .nii.gz files in DIR, as\n"
+        "with batch_niistats --cache-dir.")
+    parser.add_argument(
+        "--cache-size",
+        type=utils.parse_size,
+        default=cache.DEFAULT_MAX_BYTES,
+        metavar="SIZE",
+        help="With --cache-dir, disk space the cache may use\n"
+        "(default: 10G).")
+    args = parser.parse_args(argv)
+
+    if not hasattr(socket, "AF_UNIX"):
+        parser.error("batch_niistats serve needs Unix-domain sockets, "
+                     "which this system doesn't support")
+    cache.configure(args.cache_dir, args.cache_size)
+    try:
+        remove_stale_socket(args.socket)
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    with BatchServer(args.socket, args.workers) as server:
+        print(f"[{utils.get_timestamp()}] batch_niistats serve: listening "
+              f"on {args.socket} with {server.scheduler.workers} workers. "
+              "Press Ctrl+C to stop.\n")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    print("Stopped serving.")
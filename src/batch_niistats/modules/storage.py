@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Storage backends for reading .nii files from local disk or from URLs
+    such as s3://bucket/sub-01_bold.nii. Backends follow a small subset of
+    the fsspec filesystem interface (exists, size, cat_file with a byte
+    range), so any fsspec filesystem can be used, and reads are done in
+    byte ranges so that only the parts of a file that are needed are
+    fetched.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+import io
+import os
+import threading
+
+try:
+    import fsspec
+except ImportError:  # only needed for URLs without a registered backend
+    fsspec = None
+
+_FILESYSTEMS = {}
+_FILESYSTEMS_LOCK = threading.Lock()
+
+
+def register_filesystem(protocol: str, filesystem) -> None:
+    """Use filesystem for all paths starting with protocol://
+
+    filesystem needs exists(path), size(path) and
+    cat_file(path, start, end) methods, like fsspec filesystems.
+    """
+    with _FILESYSTEMS_LOCK:
+        _FILESYSTEMS[protocol] = filesystem
+
+
+def split_protocol(path: str) -> tuple[str, str]:
+    """Split 'protocol://rest' into its parts; local paths are 'file'"""
+    protocol, sep, rest = str(path).partition('://')
+    if not sep:
+        return 'file', str(path)
+    return protocol, rest if protocol == 'file' else str(path)
+
+
+def local_path(path: str) -> str:
+    """Path without its file:// prefix, for opening local files
+
+    URLs are returned unchanged.
+    """
+    return split_protocol(path)[1]
+
+
+def is_url(path: str) -> bool:
+    """Whether path points to a remote file, e.g. s3://bucket/file.nii"""
+    return split_protocol(path)[0] != 'file'
+
+
+def get_filesystem(path: str) -> tuple[object, str]:
+    """Return the backend for a path and the path to pass to it
+
+    Backends are created once per protocol and reused for every file, so
+    connections are shared across rows. Protocols without a registered
+    backend are opened with fsspec, if it is installed.
+    """
+    protocol, backend_path = split_protocol(path)
+    with _FILESYSTEMS_LOCK:
+        if protocol not in _FILESYSTEMS:
+            if fsspec is None:
+                raise ValueError(f"No storage backend for {protocol}:// "
+                                 "paths. Install fsspec (and the package "
+                                 "for this protocol, e.g. s3fs) to read "
+                                 "them.")
+            _FILESYSTEMS[protocol] = fsspec.filesystem(protocol)
+        return _FILESYSTEMS[protocol], backend_path
+
+
+def exists(path: str) -> bool:
+    """Whether a local path or URL exists"""
+    if not is_url(path):
+        return os.path.exists(local_path(path))
+    try:
+        filesystem, backend_path = get_filesystem(path)
+        return filesystem.exists(backend_path)
+    except Exception:
+        return False
+
+
+def read_bytes(path: str) -> bytes:
+    """Read the whole contents of a local path or URL"""
+    filesystem, backend_path = get_filesystem(path)
+    return filesystem.cat_file(backend_path)
+
+
+class RangeFile(io.RawIOBase):
+    """Read-only, seekable file object that reads through byte ranges
+
+    Every read fetches only the requested bytes from the backend, so
+    nibabel can read the header and then seek straight to one volume.
+    Each RangeFile has its own position; make one per thread.
+    """
+
+    def __init__(self, path: str):
+        self.name = str(path)
+        self._filesystem, self._path = get_filesystem(path)
+        self._size = None
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def size(self) -> int:
+        if self._size is None:
+            self._size = self._filesystem.size(self._path)
+        return self._size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size()
+        self._position = max(0, offset)
+        return self._position
+
+    def readall(self) -> bytes:
+        data = self._filesystem.cat_file(self._path, self._position, None)
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self._filesystem.cat_file(self._path,
+                                         self._position,
+                                         self._position + len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
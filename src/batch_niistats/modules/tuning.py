@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Adaptive worker count (--workers auto). Measures how much of each
+    task is spent waiting on I/O and how busy the CPUs are, and grows or
+    shrinks the number of tasks in flight while the batch runs.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+from collections.abc import Callable, Iterable
+import concurrent.futures
+import math
+import os
+import threading
+import time
+from batch_niistats.modules import utils
+
+
+class AdaptiveWorkers:
+    """Run tasks with a concurrency limit that is tuned during the run
+
+    After every window of finished tasks, the limit is set to
+
+        n_cpus / (1 - io_wait)
+
+    where io_wait is the share of task wall time not spent on the CPU
+    (measured with time.thread_time), so I/O-bound runs get more tasks in
+    flight. The limit is not raised while the CPUs are already saturated,
+    and a change that lowered throughput is undone. Every change is
+    printed so that the final value can be pinned with --workers.
+    """
+
+    def __init__(self,
+                 min_workers: int = 1,
+                 max_workers: int = 64,
+                 n_cpus: int | None = None,
+                 window: int | None = None):
+        self.n_cpus = n_cpus or os.cpu_count() or 1
+        self.min_workers = min_workers
+        self.max_workers = max(max_workers, min_workers)
+        self.workers = min(max(self.n_cpus, min_workers), self.max_workers)
+        self.window = window
+        self.history = []  # (workers, io_wait, cpu_busy, tasks per second)
+        self._low, self._high = self.min_workers, self.max_workers
+
+        self._lock = threading.Condition()
+        self._active = 0
+        self._reset_window()
+        self._last_change = None  # (previous workers, throughput before)
+
+    def _reset_window(self):
+        self._done = 0
+        self._task_wall = 0.0
+        self._task_cpu = 0.0
+        self._window_start = time.perf_counter()
+        self._window_cpu = time.process_time()
+
+    def _run(self, fn: Callable, item):
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            return fn(item)
+        finally:
+            task_wall = time.perf_counter() - start_wall
+            task_cpu = time.thread_time() - start_cpu
+            with self._lock:
+                self._active -= 1
+                self._done += 1
+                self._task_wall += task_wall
+                self._task_cpu += task_cpu
+                if self._done >= (self.window or 2 * self.workers):
+                    self._retune()
+                self._lock.notify_all()
+
+    def _retune(self):
+        """Pick a new limit from the last window (called with the lock)"""
+        elapsed = time.perf_counter() - self._window_start
+        throughput = self._done / max(elapsed, 1e-9)
+        io_wait = 1 - min(self._task_cpu / max(self._task_wall, 1e-9), 1.0)
+        cpu_busy = (time.process_time() - self._window_cpu) / \
+            max(elapsed, 1e-9) / self.n_cpus
+        self.history.append((self.workers, io_wait, cpu_busy, throughput))
+
+        estimate = math.ceil(self.n_cpus / max(1 - io_wait, 0.05))
+        reverting = self._last_change is not None and \
+            throughput < 0.9 * self._last_change[1]
+        if reverting:
+            # last change made it slower: go back, and don't try it again
+            target = self._last_change[0]
+            if self.workers > target:
+                self._high = min(self._high, self.workers - 1)
+            else:
+                self._low = max(self._low, self.workers + 1)
+        elif cpu_busy >= 0.9:
+            target = min(estimate, self.workers)  # CPUs are saturated
+        else:
+            target = estimate
+        target = min(max(target, self._low), self._high)
+
+        if target != self.workers:
+            self._last_change = None if reverting else \
+                (self.workers, throughput)
+            print(f"[{utils.get_timestamp()}] --workers auto: "
+                  f"{self.workers} -> {target} workers (io wait "
+                  f"{io_wait:.0%}, cpu busy {cpu_busy:.0%}, "
+                  f"{throughput:.1f} files/s)")
+            self.workers = target
+        else:
+            self._last_change = None
+        self._reset_window()
+
+    def map(self, fn: Callable, items: Iterable) -> list:
+        """Call fn on every item and return the results in order"""
+        self._reset_window()
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) \
+                as executor:
+            futures = []
+            for item in items:
+                with self._lock:
+                    self._lock.wait_for(
+                        lambda: self._active < self.workers)
+                    self._active += 1
+                futures.append(executor.submit(self._run, fn, item))
+            results = [future.result() for future in futures]
+
+        print(f"[{utils.get_timestamp()}] --workers auto finished with "
+              f"{self.workers} workers. To reuse this setting, run with "
+              f"--workers {self.workers}\n")
+        return results
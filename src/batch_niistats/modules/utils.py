@@ -10,10 +10,15 @@
     CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
 """
 
-import tkinter as tk
-from tkinter import filedialog
+import argparse
+try:
+    import tkinter as tk
+    from tkinter import filedialog
+except ImportError:  # pragma: no cover - headless python builds
+    tk = None
 import pandas as pd
 import datetime
+import math
 import os
 import numpy as np
 
@@ -47,6 +52,50 @@ def parse_inputs(input_arg: str) -> dict[str, bool | str] | None:
     return option_map.get(input_arg, {})
 
 
+def parse_positive_int(value: str) -> int:
+    """Parse an option that takes a positive integer, e.g. --io-workers"""
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(
+            f"must be a positive integer, not {value!r}")
+    return int(value)
+
+
+def parse_workers(value: str) -> int | str:
+    """Parse the --workers option, a positive integer or 'auto'"""
+    if value == 'auto':
+        return value
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(
+            f"must be a positive integer or 'auto', not {value!r}")
+    return int(value)
+
+
+def parse_axes(value: str) -> tuple[str, ...]:
+    """Parse the --profile option, a comma-separated list of x, y and z"""
+    axes = tuple(dict.fromkeys(
+        axis.strip().lower() for axis in value.split(',') if axis.strip()))
+    if not axes or not set(axes) <= {'x', 'y', 'z'}:
+        raise argparse.ArgumentTypeError(
+            f"must be a comma-separated list of x, y and z, not {value!r}")
+    return axes
+
+
+def parse_size(value: str) -> int:
+    """Parse a size in bytes with an optional K/M/G/T suffix, e.g. '10G'"""
+    units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+             'T': 1024 ** 4}
+    number = value.strip().upper().removesuffix('B')
+    unit = number[-1:] if number[-1:] in units else ''
+    try:
+        size = float(number.removesuffix(unit)) * units[unit]
+    except ValueError:
+        size = -1
+    if not 0 < size < math.inf:  # also rejects inf and nan
+        raise argparse.ArgumentTypeError(
+            f"must be a size such as 500M or 10G, not {value!r}")
+    return int(size)
+
+
 def askfordatalist() -> str:
     """Prompt user for input CSV file and return full file path as string."""
     root = tk.Tk()
@@ -135,7 +184,16 @@ def load_datalist(datalist_filepath: str) -> pd.DataFrame:
     files and 'volume_0basedindex' column with volume indices. Other
     columns in the datalist, if existing, are left unmodified.
     """
-    datalist = pd.read_csv(datalist_filepath)
+    return prepare_datalist(pd.read_csv(datalist_filepath))
+
+
+def prepare_datalist(datalist: pd.DataFrame) -> pd.DataFrame:
+    """Resolve files and volumes for a datalist that is already in memory
+
+    Same as load_datalist, but takes a dataframe with an 'input_file'
+    column instead of a path to a .csv file.
+    """
+    datalist = datalist.reset_index(drop=True)
 
     # now check for SPM volume syntax
     if datalist['input_file'].astype(str).str.contains(',').any():
@@ -150,13 +208,54 @@ def load_datalist(datalist_filepath: str) -> pd.DataFrame:
     return prioritize_volume(datalist)
 
 
+def datalist_from_files(list_of_files: list[str]) -> pd.DataFrame:
+    """Create a datalist for discovered files, reading the first volume
+
+    File paths are used as they are, without checking for SPM syntax.
+    """
+    return pd.DataFrame({'input_file': list_of_files,
+                         'file': list_of_files,
+                         'volume_0basedindex': 0})
+
+
+def save_datalist(datalist: pd.DataFrame,
+                  datalist_filepath: str):
+    """Save the 'input_file' column as a datalist that can be reused"""
+    datalist[['input_file']].to_csv(datalist_filepath, index=False)
+    print(f"\nDatalist saved to file:\n{datalist_filepath}\n")
+
+
 def create_output_df(datalist: pd.DataFrame,
                      list_of_data: list) -> pd.DataFrame:
     """Merges input and output df and returns df with original index order"""
     calculated_df = pd.DataFrame(list_of_data)
-    calculated_df['input_file'] = calculated_df['input_file'].str.strip()
     calculated_df = calculated_df.reset_index()
 
+    return merge_output_df(datalist, calculated_df)
+
+
+def create_series_output_df(datalist: pd.DataFrame,
+                            list_of_lists: list) -> pd.DataFrame:
+    """Merges input and output df when rows have several outputs each
+
+    Each element of list_of_lists holds the output rows (e.g. one per
+    volume) for the datalist row at the same position. Input columns are
+    repeated for every output row, in the original index order.
+    """
+    calculated_df = pd.DataFrame(
+        [dict(row, index=index)
+         for index, rows in enumerate(list_of_lists)
+         for row in rows],
+        columns=None if any(list_of_lists) else ['index', 'input_file'])
+
+    return merge_output_df(datalist, calculated_df)
+
+
+def merge_output_df(datalist: pd.DataFrame,
+                    calculated_df: pd.DataFrame) -> pd.DataFrame:
+    """Merge calculated rows onto the datalist using the 'index' column"""
+    calculated_df['input_file'] = calculated_df['input_file'].str.strip()
+
     input_df = datalist.drop(columns=["volume_0basedindex", "file"],
                              axis=1,
                              errors='ignore')
@@ -167,7 +266,7 @@ def create_output_df(datalist: pd.DataFrame,
                                  on=['input_file', 'index'],
                                  how='outer',
                                  sort=False)
-    combined_df = combined_df.sort_values(by='index')
+    combined_df = combined_df.sort_values(by='index', kind='stable')
     combined_df = combined_df.drop(columns=["index"], axis=1)
     combined_df = combined_df.reset_index(drop=True)
 
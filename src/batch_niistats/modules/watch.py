@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding : utf-8 -*-
+
+"""
+    Watch mode (--watch): a long-running loop that polls a datalist or
+    directory, calculates statistics only for files that are new or have
+    changed since the last poll, and appends them to the output .csv.
+
+    Part of batch_niistats package.
+
+    CMcC 4/21/2025 github: https://github.com/mcclaskey/batch_niistats.
+"""
+
+from collections.abc import Callable
+import concurrent.futures
+import os
+import time
+import pandas as pd
+from batch_niistats.modules import api, storage, utils
+
+
+def file_signature(nii_file: str) -> tuple[int, int] | None:
+    """Return (size, mtime in ns) of a file, or None if it doesn't exist"""
+    try:
+        stat = os.stat(storage.local_path(nii_file))
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def find_changed_rows(datalist: pd.DataFrame,
+                      seen: dict[tuple, tuple[int, int]],
+                      settle: float
+                      ) -> tuple[pd.DataFrame, list[tuple[int, int]]]:
+    """Select rows whose file is new or changed since it was last processed
+
+    Rows are identified by (input_file, file, volume). Files that don't
+    exist yet, or were modified less than settle seconds ago (they may
+    still be being written), are left for a later poll. Returns the
+    selected rows and their file signatures.
+    """
+    keep, signatures = [], []
+    now_ns = time.time_ns()
+    for nii_rawinput, nii_file, nii_volume in zip(
+            datalist['input_file'],
+            datalist['file'],
+            datalist['volume_0basedindex']):
+        signature = file_signature(nii_file)
+        changed = signature is not None and \
+            seen.get((nii_rawinput, nii_file, nii_volume)) != signature and \
+            now_ns - signature[1] >= settle * 1e9
+        keep.append(changed)
+        if changed:
+            signatures.append(signature)
+
+    return datalist[keep].reset_index(drop=True), signatures
+
+
+def append_output_csv(output_df: pd.DataFrame,
+                      output_path: str):
+    """Append rows to the output csv, writing the header if it's new"""
+    write_header = not os.path.exists(output_path)
+    output_df.to_csv(output_path, mode='a', header=write_header, index=False)
+
+
+def watch(load_rows: Callable[[], pd.DataFrame],
+          inputs: dict[str, bool | str],
+          output_path: str,
+          interval: float = 5.0,
+          workers: int | None = None,
+          settle: float = 2.0,
+          max_polls: int | None = None) -> int:
+    """Poll for new or changed files and append their statistics
+
+    load_rows is called at every poll and returns the current datalist
+    (e.g. by re-reading the datalist .csv or re-scanning a directory).
+    Only rows whose file is new or whose size or modification time changed
+    are calculated, using a worker pool that stays up between polls, and
+    their output rows are appended to output_path. Runs until interrupted
+    with Ctrl+C, or for max_polls polls. Returns the number of rows
+    calculated.
+    """
+    seen = {}
+    n_rows = 0
+    n_polls = 0
+    print(f"Watching for new files every {interval:g} s, "
+          "press Ctrl+C to stop.\n")
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        try:
+            while max_polls is None or n_polls < max_polls:
+                if n_polls:
+                    time.sleep(interval)
+                n_polls += 1
+
+                try:
+                    datalist = load_rows()
+                except Exception as e:
+                    print(f"Could not read the list of files: {e}")
+                    continue
+
+                changed, signatures = find_changed_rows(datalist,
+                                                        seen,
+                                                        settle)
+                if changed.empty:
+                    continue
+
+                # errors are kept as notes so that one bad file
+                # doesn't stop the loop
+                list_of_data = list(executor.map(
+                    lambda args: api.try_multi_nii_calc(args[0],
+                                                        args[1],
+                                                        args[2],
+                                                        [inputs]),
+                    zip(changed['input_file'],
+                        changed['file'],
+                        changed['volume_0basedindex'])))
+                append_output_csv(utils.create_output_df(changed,
+                                                         list_of_data),
+                                  output_path)
+
+                for key, signature in zip(
+                        zip(changed['input_file'],
+                            changed['file'],
+                            changed['volume_0basedindex']),
+                        signatures):
+                    seen[key] = signature
+                n_rows += len(changed)
+                print(f"[{utils.get_timestamp()}] Added {len(changed)} "
+                      f"rows to:\n{output_path}\n")
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+
+    return n_rows
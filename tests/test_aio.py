@@ -0,0 +1,77 @@
+import asyncio
+import concurrent.futures
+import time
+import numpy as np
+import pandas as pd
+from batch_niistats.modules import aio
+
+files = ["tests/data/dki_kfa.nii",
+         "tests/data/fmri_4d.nii.gz,2",
+         "tests/data/missing.nii"]
+
+
+def test_acompute_matches_expected():
+    """acompute returns the same table as the command line tool"""
+    result = asyncio.run(aio.acompute(files, stats=["m"]))
+
+    assert isinstance(result, pd.DataFrame)
+    assert result.shape == (3, 5)
+    assert np.allclose(result["mean of all voxels"],
+                       [0.069626, 880.965823, np.nan],
+                       atol=0.01, equal_nan=True)
+
+
+def test_concurrent_requests_share_pool_without_starving_loop():
+    """Many async calls share one small pool while the loop keeps ticking"""
+    ticks = []
+
+    async def heartbeat(stop):
+        while not stop.is_set():
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.005)
+
+    async def request(executor):
+        return [item async for item in aio.aiter_compute(
+            files * 2, "M", executor=executor, max_concurrency=2)]
+
+    async def main():
+        stop = asyncio.Event()
+        beat = asyncio.create_task(heartbeat(stop))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            results = await asyncio.gather(*[request(pool)
+                                             for _ in range(8)])
+        stop.set()
+        await beat
+        return results
+
+    results = asyncio.run(main())
+
+    assert len(results) == 8
+    for result in results:
+        assert sorted(index for index, _ in result) == list(range(6))
+    # the loop was never blocked by a .nii load
+    assert len(ticks) > 5
+    assert max(np.diff(ticks)) < 0.5
+
+
+def test_closing_iterator_cancels_pending_rows(mocker):
+    """Stopping early leaves rows that haven't started unprocessed"""
+    def slow_load(img_proxy, nii_volume):
+        time.sleep(0.05)
+        return np.ones((2, 2, 2))
+    mock_load = mocker.patch("batch_niistats.modules.nii.get_volume",
+                             side_effect=slow_load)
+
+    async def main():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            rows = aio.aiter_compute([files[0]] * 20, "m",
+                                     executor=pool,
+                                     max_concurrency=1)
+            first = await anext(rows)
+            await rows.aclose()
+        return first
+
+    index, result = asyncio.run(main())
+
+    assert result["mean of all voxels"] == 1.0
+    assert mock_load.call_count < 5
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+import batch_niistats
+from batch_niistats.modules import api
+
+
+def test_compute_from_datalist_path():
+    """compute returns the same table as the command line tool"""
+    result = batch_niistats.compute("tests/data/sample_datalist.csv",
+                                    stats=["M", "s"])
+
+    assert isinstance(result, pd.DataFrame)
+    assert result.shape == (6, 6)
+    assert np.allclose(result["mean of nonzero voxels"],
+                       [1037.736913, 1037.729177, 1037.736913,
+                        0.279955, 0.279955, np.nan],
+                       atol=0.01, equal_nan=True)
+    assert np.allclose(result["sd of all voxels"],
+                       [1643.971591, 1641.771553, 1643.971591,
+                        0.148956, 0.148956, np.nan],
+                       atol=0.01, equal_nan=True)
+    assert result.loc[5, "note"] == "file not found"
+
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_compute_as_array(backend):
+    """File lists with SPM syntax can be returned as a NumPy array"""
+    result = api.compute(["tests/data/fmri_4d.nii.gz,2",
+                          "tests/data/dki_kfa.nii",
+                          "tests/data/missing.nii"],
+                         stats="m",
+                         workers=2,
+                         backend=backend,
+                         as_array=True)
+
+    assert result.shape == (3, 1)
+    assert np.allclose(result[:, 0], [880.965823, 0.069626, np.nan],
+                       atol=0.01, equal_nan=True)
+
+
+def test_iter_compute_yields_every_row_once():
+    """Streamed results carry their row index"""
+    files = ["tests/data/dki_kfa.nii", "tests/data/fmri_4d.nii.gz"] * 3
+    results = dict(api.iter_compute(files, stats=["M"], workers=3))
+
+    assert sorted(results) == list(range(6))
+    for index, result in results.items():
+        assert result["filename"] == files[index]
+        assert result["note"] == "file exists"
+
+
+def test_iter_compute_records_errors(mocker):
+    """Rows that raise keep their index and report the error"""
+    mocker.patch("batch_niistats.modules.api.nii.open_nii",
+                 side_effect=Exception("Test error"))
+    mocker.patch("builtins.print")
+    [(index, result)] = api.iter_compute(["tests/data/dki_kfa.nii"])
+
+    assert index == 0
+    assert result["mean of nonzero voxels"] is None
+    assert result["note"] == "error: Test error"
+
+
+def test_invalid_stats_and_backend():
+    with pytest.raises(ValueError):
+        api.compute(["tests/data/dki_kfa.nii"], stats=["X"])
+    with pytest.raises(ValueError):
+        api.compute(["tests/data/dki_kfa.nii"], backend="gpu")
@@ -0,0 +1,137 @@
+import concurrent.futures
+import gzip
+import os
+import numpy as np
+import pytest
+from batch_niistats.modules import cache, nii
+
+
+@pytest.fixture
+def gz_files(tmp_path):
+    """Three small .nii.gz copies of the same image"""
+    with open("tests/data/dki_kfa.nii.gz", "rb") as f:
+        contents = f.read()
+    files = []
+    for i in range(3):
+        nii_file = tmp_path / f"image{i}.nii.gz"
+        nii_file.write_bytes(contents)
+        files.append(str(nii_file))
+    return files
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "cache")
+
+
+def test_cached_copy_is_uncompressed(gz_files, cache_dir):
+    decompressed = cache.DecompressedCache(cache_dir)
+    entry = decompressed.cached_path(gz_files[0])
+
+    assert entry.startswith(cache_dir) and entry.endswith(".nii")
+    with gzip.open(gz_files[0], "rb") as f, open(entry, "rb") as g:
+        assert f.read() == g.read()
+    assert decompressed.cached_path(gz_files[0]) == entry
+    assert decompressed.cached_path("tests/data/dki_kfa.nii") == \
+        "tests/data/dki_kfa.nii"
+
+
+def test_changed_file_gets_new_entry(gz_files, cache_dir):
+    decompressed = cache.DecompressedCache(cache_dir)
+    entry = decompressed.cached_path(gz_files[0])
+    stat = os.stat(gz_files[0])
+    os.utime(gz_files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert decompressed.lookup(gz_files[0]) is None
+    assert decompressed.cached_path(gz_files[0]) != entry
+
+
+def test_least_recently_used_are_evicted(gz_files, cache_dir):
+    """The budget holds two entries; the one used longest ago goes"""
+    entry_size = os.path.getsize("tests/data/dki_kfa.nii")
+    decompressed = cache.DecompressedCache(cache_dir, 2 * entry_size)
+    first, second = [decompressed.cached_path(f) for f in gz_files[:2]]
+    os.utime(second, ns=(0, 0))  # used long ago
+    os.utime(first)
+    third = decompressed.cached_path(gz_files[2])
+
+    assert os.path.exists(first) and os.path.exists(third)
+    assert not os.path.exists(second)
+
+
+def test_file_larger_than_budget_is_not_cached(gz_files, cache_dir):
+    decompressed = cache.DecompressedCache(cache_dir, 1000)
+
+    assert decompressed.cached_path(gz_files[0]) == gz_files[0]
+    assert os.listdir(cache_dir) == []
+
+
+def test_concurrent_workers_decompress_once(mocker, gz_files, cache_dir):
+    """Workers asking for the same file wait for the one decompressing it"""
+    mock_gzip_open = mocker.patch("batch_niistats.modules.cache.gzip.open",
+                                  wraps=gzip.open)
+    decompressed = cache.DecompressedCache(cache_dir)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        entries = list(executor.map(decompressed.cached_path,
+                                    [gz_files[0]] * 16))
+
+    assert len(set(entries)) == 1
+    assert mock_gzip_open.call_count == 1
+    assert sorted(os.listdir(cache_dir)) == [os.path.basename(entries[0])]
+
+
+def test_stale_lock_falls_back_to_original(mocker, gz_files, cache_dir):
+    mocker.patch("batch_niistats.modules.cache.LOCK_TIMEOUT", 0.1)
+    decompressed = cache.DecompressedCache(cache_dir)
+    open(decompressed.entry_path(gz_files[0]) + ".lock", "w").close()
+
+    assert decompressed.cached_path(gz_files[0]) == gz_files[0]
+    assert decompressed.cached_path(gz_files[0]) != gz_files[0]
+
+
+def test_open_nii_uses_configured_cache(gz_files, cache_dir):
+    cache.configure(cache_dir)
+    try:
+        img_proxy = nii.open_nii(gz_files[0])
+    finally:
+        cache.configure(None)
+
+    assert img_proxy.get_filename().startswith(cache_dir)
+    assert np.array_equal(nii.get_volume(img_proxy, 0),
+                          nii.load_nii("tests/data/dki_kfa.nii", 0))
+    assert nii.open_nii(gz_files[0]).get_filename() == gz_files[0]
+
+
+def test_entry_evicted_before_open_is_populated_again(gz_files, cache_dir):
+    decompressed = cache.DecompressedCache(cache_dir)
+    cached_path = decompressed.cached_path
+
+    def evicted_after_lookup(input_file):
+        entry = cached_path(input_file)
+        os.remove(entry)  # another job evicts it before it is opened
+        decompressed.cached_path = cached_path
+        return entry
+
+    decompressed.cached_path = evicted_after_lookup
+    with decompressed.open(gz_files[0]) as f:
+        contents = f.read()
+    with gzip.open(gz_files[0], "rb") as f:
+        assert contents == f.read()
+    assert decompressed.open("tests/data/dki_kfa.nii") is None
+
+
+@pytest.mark.skipif(os.name == "nt",
+                    reason="open files can't be removed on Windows")
+def test_open_nii_survives_eviction(gz_files, cache_dir):
+    cache.configure(cache_dir)
+    try:
+        img_proxy = nii.open_nii(gz_files[0])
+        raw_bytes = nii.read_nii_bytes(gz_files[0])
+    finally:
+        cache.configure(None)
+    for entry in os.listdir(cache_dir):
+        os.remove(os.path.join(cache_dir, entry))
+
+    assert np.array_equal(nii.get_volume(img_proxy, 0),
+                          nii.load_nii("tests/data/dki_kfa.nii", 0))
+    assert raw_bytes[:2] != nii.GZIP_MAGIC
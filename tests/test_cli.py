@@ -157,3 +157,308 @@ def test_cli_entrypoint_runs():
                             timeout=10)
     assert result.returncode == 0
     assert "usage:" in result.stdout
+
+
+@pytest.mark.parametrize("args, expected_statistic, answer", [
+    (["M", "--all-volumes"], "mean of nonzero voxels",
+     [1037.736913, 1037.729177]),
+    (["s", "--all-volumes"], "sd of all voxels",
+     [1643.971591, 1641.771553]),
+])
+def test_cli_main_all_volumes(mocker, args, expected_statistic, answer):
+    "Tests whole-series mode, one output row per volume"
+    sample_datalist_path = "tests/data/sample_datalist_nospmsyntax.csv"
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=sample_datalist_path)
+    mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                 return_value=None)
+
+    sys.argv = ["batch_niistats.py"] + args
+    test_result = cli.main()
+
+    assert test_result.shape == (2, 5)
+    assert test_result["volume_0basedindex"].tolist() == [0, 1]
+    assert np.allclose(test_result[expected_statistic], answer, atol=0.01)
+
+
+def test_cli_main_group_maps(mocker):
+    "Tests group map mode, one note per input row"
+    sample_datalist_path = "tests/data/sample_datalist.csv"
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=sample_datalist_path)
+    mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                 return_value=None)
+    mock_group = mocker.patch("batch_niistats.cli.group.group_maps",
+                              wraps=cli.group.group_maps)
+    mock_save_maps = mocker.patch(
+        "batch_niistats.cli.group.save_group_maps")
+
+    # sample datalist mixes 3D shapes, so restrict it to the 4D file
+    datalist = cli.utils.load_datalist(sample_datalist_path).iloc[:3]
+    mocker.patch("batch_niistats.cli.utils.load_datalist",
+                 return_value=datalist)
+
+    sys.argv = ["batch_niistats.py", "m", "--group-maps"]
+    test_result = cli.main()
+
+    mock_group.assert_called_once()
+    accumulator = mock_save_maps.call_args[0][0]
+    assert mock_save_maps.call_args[0][1].endswith("sample_datalist_calc_m")
+    assert accumulator.shape == (72, 87, 72)
+    assert test_result.shape == (3, 4)
+    assert (test_result["note"] == "included in group maps").all()
+
+
+def test_cli_main_group_maps_no_images(mocker, tmp_path):
+    "Tests group maps with no readable image still save the notes"
+    datalist = tmp_path / "datalist.csv"
+    datalist.write_text("input_file\nmissing.nii\n")
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=str(datalist))
+    mock_save = mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                             return_value=None)
+    mock_print = mocker.patch("builtins.print")
+
+    sys.argv = ["batch_niistats.py", "M", "--group-maps"]
+    test_result = cli.main()
+
+    mock_save.assert_called_once()
+    assert list(test_result["note"]) == ["file not found"]
+    assert not list(tmp_path.glob("*.nii.gz"))
+    assert any("No images were included" in str(call)
+               for call in mock_print.call_args_list)
+
+
+def test_cli_main_input_glob(mocker, tmp_path):
+    "Tests discovery mode, which does not ask for a datalist"
+    mock_ask = mocker.patch("batch_niistats.cli.utils.askfordatalist")
+    mock_save = mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                             return_value=None)
+    saved_datalist = str(tmp_path / "found.csv")
+
+    sys.argv = ["batch_niistats.py", "m",
+                "--input-glob", "tests/data/*.nii*",
+                "--save-datalist", saved_datalist]
+    test_result = cli.main()
+
+    mock_ask.assert_not_called()
+    assert mock_save.call_args[0][1].startswith(str(tmp_path))
+    assert sorted(test_result["input_file"]) == [
+        os.path.join("tests", "data", "dki_kfa.nii"),
+        os.path.join("tests", "data", "dki_kfa.nii.gz"),
+        os.path.join("tests", "data", "fmri_4d.nii.gz")]
+    assert (test_result["note"] == "file exists").all()
+    assert sorted(pd.read_csv(saved_datalist)["input_file"]) == \
+        sorted(test_result["input_file"])
+
+
+def test_cli_main_io_workers(mocker):
+    "Tests the read-ahead pipeline gives the same output"
+    sample_datalist_path = "tests/data/sample_datalist.csv"
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=sample_datalist_path)
+    mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                 return_value=None)
+    mock_staged = mocker.patch("batch_niistats.cli.pipeline.staged_map",
+                               wraps=cli.pipeline.staged_map)
+
+    sys.argv = ["batch_niistats.py", "S", "--io-workers", "3",
+                "--readahead", "2"]
+    test_result = cli.main()
+
+    mock_staged.assert_called_once()
+    assert np.allclose(test_result["sd of nonzero voxels"],
+                       [1738.076330, 1735.620602, 1738.076330,
+                        0.174158, 0.174159, np.nan],
+                       atol=0.01, equal_nan=True)
+    assert test_result.loc[5, "note"] == "file not found"
+
+
+def test_cli_main_file_urls(mocker, tmp_path):
+    "Tests datalist rows given as file:// URLs, with and without SPM syntax"
+    fmri = "file://" + os.path.abspath("tests/data/fmri_4d.nii.gz")
+    datalist = tmp_path / "datalist.csv"
+    datalist.write_text(f'input_file\n"{fmri},1"\n{fmri}\n')
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=str(datalist))
+    mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                 return_value=None)
+
+    sys.argv = ["batch_niistats.py", "M", "--io-workers", "2"]
+    test_result = cli.main()
+
+    assert np.allclose(test_result["mean of nonzero voxels"],
+                       [1037.729177, 1037.736913], atol=0.01)
+    assert (test_result["note"] == "file exists").all()
+
+
+def test_cli_io_workers_with_group_maps(mocker):
+    """--io-workers is rejected in modes that don't use it"""
+    mocker.patch("sys.stderr")
+    sys.argv = ["batch_niistats.py", "M", "--io-workers", "3",
+                "--group-maps"]
+    with pytest.raises(SystemExit):
+        cli.main()
+
+
+@pytest.mark.parametrize("args", [["--io-workers", "-1"],
+                                  ["--io-workers", "0"],
+                                  ["--io-workers", "2", "--readahead", "-3"],
+                                  ["--io-workers", "2", "--readahead", "0"]])
+def test_cli_io_workers_must_be_positive(mocker, args):
+    """Negative or zero reader and read-ahead counts are rejected"""
+    mock_stderr = mocker.patch("sys.stderr")
+    sys.argv = ["batch_niistats.py", "M"] + args
+    with pytest.raises(SystemExit):
+        cli.main()
+    assert "must be a positive integer" in str(mock_stderr.mock_calls)
+
+
+@pytest.mark.parametrize("mode", [["--io-workers", "3"], ["--group-maps"]])
+def test_cli_workers_auto_rejected(mocker, mode):
+    """--workers auto is rejected where it would be ignored"""
+    mock_stderr = mocker.patch("sys.stderr")
+    sys.argv = ["batch_niistats.py", "M", "--workers", "auto"] + mode
+    with pytest.raises(SystemExit):
+        cli.main()
+    assert "--workers auto can't be used" in str(mock_stderr.mock_calls)
+
+
+@pytest.mark.parametrize("workers", ["auto", "2"])
+def test_cli_main_workers(mocker, workers):
+    "Tests fixed and adaptive worker counts give the same output"
+    sample_datalist_path = "tests/data/sample_datalist.csv"
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=sample_datalist_path)
+    mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                 return_value=None)
+    mock_tuner = mocker.patch("batch_niistats.cli.tuning.AdaptiveWorkers",
+                              wraps=cli.tuning.AdaptiveWorkers)
+
+    sys.argv = ["batch_niistats.py", "m", "--workers", workers]
+    test_result = cli.main()
+
+    assert mock_tuner.called == (workers == "auto")
+    assert np.allclose(test_result["mean of all voxels"],
+                       [880.965488, 880.965823, 880.965488,
+                        0.069626, 0.069626, np.nan],
+                       atol=0.01, equal_nan=True)
+
+
+def test_cli_main_watch(mocker):
+    "Tests watch mode polls the datalist instead of running once"
+    sample_datalist_path = "tests/data/sample_datalist.csv"
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=sample_datalist_path)
+    mock_save = mocker.patch("batch_niistats.cli.utils.save_output_csv")
+    mock_watch = mocker.patch("batch_niistats.cli.watch.watch")
+
+    sys.argv = ["batch_niistats.py", "M", "--watch", "--poll-interval", "2"]
+    assert cli.main() is None
+
+    mock_save.assert_not_called()
+    load_rows, inputs, output_path = mock_watch.call_args[0]
+    assert mock_watch.call_args[1]["interval"] == 2.0
+    assert inputs == {"omit_zeros": True, "statistic": "mean"}
+    assert output_path.endswith("sample_datalist_calc_M.csv")
+    assert load_rows().shape[0] == 6
+
+
+def test_cli_main_cache_dir(mocker, tmp_path):
+    "Tests .nii.gz files are decompressed once into --cache-dir"
+    sample_datalist_path = "tests/data/sample_datalist.csv"
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=sample_datalist_path)
+    mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                 return_value=None)
+
+    sys.argv = ["batch_niistats.py", "M", "--cache-dir", str(tmp_path),
+                "--cache-size", "1G"]
+    try:
+        test_result = cli.main()
+    finally:
+        cli.cache.configure(None)
+
+    assert np.allclose(test_result["mean of nonzero voxels"],
+                       [1037.736913, 1037.729177, 1037.736913,
+                        0.279955, 0.279955, np.nan],
+                       atol=0.01, equal_nan=True)
+    # fmri_4d.nii.gz is listed three times but decompressed once
+    assert len(list(tmp_path.glob("*.nii"))) == 1
+
+
+@pytest.mark.parametrize("extra_args", [[], ["--io-workers", "2"],
+                                        ["--all-volumes"]])
+def test_cli_main_schedule_cost(mocker, extra_args):
+    "Tests rows started by cost are output in datalist order"
+    sample_datalist_path = "tests/data/sample_datalist.csv"
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=sample_datalist_path)
+    mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                 return_value=None)
+
+    sys.argv = ["batch_niistats.py", "M"] + extra_args
+    expected = cli.main()
+    mock_order = mocker.patch("batch_niistats.cli.schedule.cost_order",
+                              wraps=cli.schedule.cost_order)
+    sys.argv = ["batch_niistats.py", "M", "--schedule", "cost"] + extra_args
+    test_result = cli.main()
+
+    assert mock_order.call_args[0][1] == ("--all-volumes" in extra_args)
+    pd.testing.assert_frame_equal(test_result, expected)
+
+
+def test_cli_main_profile(mocker):
+    "Tests --profile outputs one row per slice, in datalist order"
+    sample_datalist_path = "tests/data/sample_datalist.csv"
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=sample_datalist_path)
+    mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                 return_value=None)
+
+    sys.argv = ["batch_niistats.py", "S", "--profile", "z,y"]
+    test_result = cli.main()
+
+    fmri_rows = 72 + 87
+    kfa_rows = 50 + 88
+    assert test_result.shape[0] == 3 * fmri_rows + 2 * kfa_rows + 1
+    assert list(test_result["axis"][:fmri_rows]) == ["z"] * 72 + ["y"] * 87
+    assert test_result.iloc[-1]["note"] == "file not found"
+    assert {"mean of nonzero voxels", "sd of nonzero voxels",
+            "slice_0basedindex"} <= set(test_result.columns)
+
+
+def test_cli_main_approx(mocker):
+    "Tests --approx reports estimates close to the exact values"
+    sample_datalist_path = "tests/data/sample_datalist.csv"
+    mocker.patch("batch_niistats.cli.utils.askfordatalist",
+                 return_value=sample_datalist_path)
+    mocker.patch("batch_niistats.cli.utils.save_output_csv",
+                 return_value=None)
+
+    sys.argv = ["batch_niistats.py", "m", "--approx"]
+    test_result = cli.main()
+
+    assert np.allclose(test_result["mean of all voxels"],
+                       [880.965488, 880.965823, 880.965488,
+                        0.069626, 0.069626, np.nan],
+                       rtol=0.005, equal_nan=True)
+    assert (test_result["standard error of mean of all voxels"][:5] > 0).all()
+    assert test_result.loc[5, "note"] == "file not found"
+
+
+def test_cli_imports_without_unix_sockets():
+    """Systems without Unix sockets (Windows) can still run the tool, and
+    serve exits with an error"""
+    code = ("import socket, socketserver, sys\n"
+            "for module, name in [(socket, 'AF_UNIX'),\n"
+            "                     (socketserver, 'UnixStreamServer')]:\n"
+            "    if hasattr(module, name):\n"
+            "        delattr(module, name)\n"
+            "from batch_niistats import cli\n"
+            "sys.argv = ['batch_niistats', 'serve']\n"
+            "cli.main()\n")
+    result = subprocess.run([sys.executable, "-c", code],
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 2
+    assert "needs Unix-domain sockets" in result.stderr
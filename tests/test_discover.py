@@ -0,0 +1,83 @@
+import glob
+import os
+import pytest
+from batch_niistats.modules import discover
+
+
+@pytest.fixture
+def bids_tree(tmp_path):
+    """Small BIDS-like tree with a few non-NIfTI and hidden files"""
+    for name in ["sub-01/anat/sub-01_T1w.nii.gz",
+                 "sub-01/anat/._sub-01_T1w.nii.gz",
+                 ".hidden/sub-01_T1w.nii.gz",
+                 "sub-01/func/sub-01_bold.nii",
+                 "sub-02/anat/sub-02_T1w.nii.gz",
+                 "sub-02/anat/sub-02_T1w.json",
+                 "derivatives/fmriprep/sub-01/anat/sub-01_T1w.nii.gz",
+                 "README"]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+    return tmp_path
+
+
+def test_split_glob():
+    assert discover.split_glob("data/sub-*/anat/*.nii.gz") == \
+        ("data", ["sub-*", "anat", "*.nii.gz"])
+    assert discover.split_glob("**/*.nii") == ("", ["**", "*.nii"])
+    assert discover.split_glob("data/file.nii") == \
+        (os.path.join("data", "file.nii"), [])
+
+
+def test_iter_nii_files_input_dir(bids_tree):
+    """Every visible .nii/.nii.gz file under the directory, once each"""
+    result = list(discover.iter_nii_files([str(bids_tree), str(bids_tree)],
+                                          workers=4))
+
+    assert len(result) == len(set(result)) == 4
+    assert all(discover.is_nii(path) for path in result)
+
+
+@pytest.mark.parametrize("pattern, expected", [
+    ("sub-*/anat/*.nii.gz", ["sub-01/anat/sub-01_T1w.nii.gz",
+                             "sub-02/anat/sub-02_T1w.nii.gz"]),
+    ("**/sub-01_T1w.nii.gz",
+     ["derivatives/fmriprep/sub-01/anat/sub-01_T1w.nii.gz",
+      "sub-01/anat/sub-01_T1w.nii.gz"]),
+    ("sub-01/**", ["sub-01/anat/sub-01_T1w.nii.gz",
+                   "sub-01/func/sub-01_bold.nii"]),
+    ("sub-01/func/sub-01_bold.nii", ["sub-01/func/sub-01_bold.nii"]),
+    ("sub-03/*.nii", []),
+    ("sub-01/anat/.*", ["sub-01/anat/._sub-01_T1w.nii.gz"]),
+    (".hidden/*.nii.gz", [".hidden/sub-01_T1w.nii.gz"]),
+])
+def test_iter_nii_files_matches_glob(bids_tree, pattern, expected):
+    """Results agree with glob.glob(recursive=True)"""
+    full_pattern = os.path.join(str(bids_tree), pattern)
+    result = sorted(discover.iter_nii_files(input_globs=[full_pattern]))
+
+    assert result == [os.path.join(str(bids_tree), *path.split("/"))
+                      for path in expected]
+    assert result == sorted(path for path in
+                            glob.glob(full_pattern, recursive=True)
+                            if discover.is_nii(path))
+
+
+def test_datalist_rows_discovered(bids_tree, monkeypatch):
+    """Rows are yielded as found, then listed and saved as a datalist"""
+    monkeypatch.chdir(bids_tree)
+    saved = str(bids_tree / "found.csv")
+    datalist_rows = discover.DatalistRows(input_globs=["sub-0*/**"],
+                                          save_datalist=saved)
+    rows = list(datalist_rows.rows())
+    datalist = datalist_rows.datalist()
+
+    assert datalist_rows.datalist_filepath == saved
+    assert sorted(datalist_rows.valid_files) == sorted(row[1] for row in rows)
+    assert len(rows) == 3 and all(row[2] == 0 for row in rows)
+    assert list(datalist["file"]) == [row[1] for row in rows]
+    assert os.path.exists(saved)
+
+    (bids_tree / "sub-03").mkdir()
+    (bids_tree / "sub-03" / "new.nii").touch()
+    assert len(datalist_rows.load()) == 4
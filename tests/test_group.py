@@ -0,0 +1,110 @@
+import warnings
+import nibabel as nb
+import numpy as np
+import pandas as pd
+import pytest
+from batch_niistats.modules import group, nii
+
+rng = np.random.default_rng(0)
+stack = rng.normal(10, 3, size=(7, 4, 5, 6))
+stack[stack < 8] = 0  # plenty of zeros for the nonzero option
+
+
+@pytest.mark.parametrize("omit_zeros", [False, True])
+def test_accumulator_matches_numpy(omit_zeros):
+    """Running mean/sd equal mean/sd of the stacked images"""
+    accumulator = group.VoxelwiseAccumulator(omit_zeros)
+    for image in stack:
+        accumulator.update(image, np.eye(4))
+
+    data = np.where(stack != 0, stack, np.nan) if omit_zeros else stack
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-zero voxels
+        expected_mean = np.nanmean(data, axis=0)
+        expected_sd = np.nanstd(data, axis=0)
+
+    np.testing.assert_allclose(accumulator.mean(), expected_mean)
+    np.testing.assert_allclose(accumulator.sd(), expected_sd, atol=1e-12)
+    np.testing.assert_array_equal(accumulator.count,
+                                  (~np.isnan(data)).sum(axis=0))
+
+
+@pytest.mark.parametrize("omit_zeros", [False, True])
+def test_accumulator_merge(omit_zeros):
+    """Merging shards gives the same result as one accumulator"""
+    single = group.VoxelwiseAccumulator(omit_zeros)
+    shards = [group.VoxelwiseAccumulator(omit_zeros) for _ in range(3)]
+    for index, image in enumerate(stack):
+        single.update(image, np.eye(4))
+        shards[index % 3].update(image, np.eye(4))
+
+    merged = group.VoxelwiseAccumulator(omit_zeros)
+    for shard in shards + [group.VoxelwiseAccumulator(omit_zeros)]:
+        merged.merge(shard)
+
+    np.testing.assert_array_equal(merged.count, single.count)
+    np.testing.assert_allclose(merged.mean(), single.mean())
+    np.testing.assert_allclose(merged.sd(ddof=1), single.sd(ddof=1))
+
+
+def test_accumulator_checks_shape_and_affine():
+    accumulator = group.VoxelwiseAccumulator()
+    accumulator.update(stack[0], np.eye(4))
+    with pytest.raises(ValueError, match="shape"):
+        accumulator.update(stack[0, :3], np.eye(4), "bad.nii")
+    with pytest.raises(ValueError, match="affine"):
+        accumulator.update(stack[1], np.diag([2, 2, 2, 1]), "bad.nii")
+
+
+def test_group_maps_and_save(mocker, tmp_path):
+    """Group maps over a datalist, missing files are noted and skipped"""
+    mocker.patch("builtins.print")
+    nii_file = 'tests/data/fmri_4d.nii.gz'
+    datalist = pd.DataFrame({'input_file': [nii_file, 'missing.nii',
+                                            nii_file],
+                             'file': [nii_file, 'missing.nii', nii_file],
+                             'volume_0basedindex': [0, 0, 1]})
+    accumulator, notes = group.group_maps(datalist,
+                                          {'omit_zeros': False},
+                                          {nii_file},
+                                          workers=2)
+
+    volumes = np.stack([nii.load_nii(nii_file, 0), nii.load_nii(nii_file, 1)])
+    np.testing.assert_allclose(accumulator.mean(), volumes.mean(axis=0))
+    np.testing.assert_allclose(accumulator.sd(), volumes.std(axis=0),
+                               atol=1e-8)
+    assert [note['note'] for note in notes] == ['included in group maps',
+                                                'file not found',
+                                                'included in group maps']
+
+    paths = group.save_group_maps(accumulator, str(tmp_path / "out"))
+    saved_mean = nb.load(paths['mean'])
+    assert saved_mean.shape == (72, 87, 72)
+    np.testing.assert_allclose(saved_mean.affine, nb.load(nii_file).affine)
+    assert nb.load(paths['count']).get_fdata().max() == 2
+
+
+def test_group_maps_skips_mismatched_images(mocker):
+    """An image on a different grid is noted and left out, wherever it
+    falls in the shards"""
+    mocker.patch("builtins.print")
+    fmri, kfa = 'tests/data/fmri_4d.nii.gz', 'tests/data/dki_kfa.nii'
+    datalist = pd.DataFrame({'input_file': [fmri, kfa, fmri],
+                             'file': [fmri, kfa, fmri],
+                             'volume_0basedindex': [0, 0, 1]})
+    accumulator, notes = group.group_maps(datalist,
+                                          {'omit_zeros': False},
+                                          {fmri, kfa},
+                                          workers=2)
+
+    assert [note['note'] for note in notes] == [
+        'included in group maps',
+        'error: shape/affine mismatch',
+        'included in group maps']
+    assert accumulator.shape == (72, 87, 72)
+    assert accumulator.count.max() == 2
+
+
+def test_save_group_maps_empty():
+    with pytest.raises(ValueError):
+        group.save_group_maps(group.VoxelwiseAccumulator(), "out")
@@ -1,3 +1,4 @@
+import nibabel as nb
 import numpy as np
 import pytest
 from batch_niistats.modules import nii
@@ -198,3 +199,366 @@ def test_try_single_nii_calc_error(mocker, inputs, expected_statistic, answer):
         f"Error processing {nii_file}: Test error"
         )
     assert result is None
+
+
+@pytest.mark.parametrize("chunk_bytes", [1, nii.SERIES_CHUNK_BYTES])
+def test_iter_nii_series(chunk_bytes):
+    """Chunks cover every volume once, in order"""
+    nii_file = 'tests/data/fmri_4d.nii.gz'
+    chunks = list(nii.iter_nii_series(nii_file, chunk_bytes))
+    series = np.concatenate([chunk for _, chunk in chunks], axis=3)
+
+    assert [start for start, _ in chunks] == \
+        ([0, 1] if chunk_bytes == 1 else [0])
+    assert series.shape == (72, 87, 72, 2)
+    np.testing.assert_allclose(series[..., 1], nii.load_nii(nii_file, 1))
+
+
+def test_iter_nii_series_3d():
+    """A 3D file is read as one volume"""
+    [(start, chunk)] = nii.iter_nii_series('tests/data/dki_kfa.nii')
+    assert start == 0
+    assert chunk.shape == (88, 88, 50, 1)
+
+
+@pytest.mark.parametrize("inputs, expected_statistic, answer",
+                         list_of_inputs_to_decorate)
+def test_series_stat_matches_single_volume(inputs, expected_statistic,
+                                           answer):
+    """Axis reduction gives the same value as each volume on its own"""
+    nii_file = 'tests/data/fmri_4d.nii.gz'
+    [(_, series)] = nii.iter_nii_series(nii_file)
+    result = nii.series_stat(series, inputs)
+
+    assert result.shape == (2,)
+    for volume in range(2):
+        expected = nii.calc_nii_stat(nii.load_nii(nii_file, volume), inputs)
+        assert np.isclose(result[volume], expected, rtol=1e-9)
+
+
+def test_series_nii_calc():
+    """One output row per volume"""
+    nii_file = 'tests/data/fmri_4d.nii.gz'
+    inputs = {"statistic": "mean", "omit_zeros": True}
+    result = nii.series_nii_calc(nii_file, nii_file, inputs, {nii_file})
+
+    assert [row['volume_0basedindex'] for row in result] == [0, 1]
+    assert np.allclose([row['mean of nonzero voxels'] for row in result],
+                       [1037.736913, 1037.729177], atol=0.01)
+    assert all(row['note'] == 'file exists' for row in result)
+
+
+def test_series_nii_calc_nonexistentfile(mocker):
+    """Missing files give a single row"""
+    mocker.patch("builtins.print")
+    inputs = {"statistic": "sd", "omit_zeros": False}
+    [row] = nii.series_nii_calc('missing.nii', 'missing.nii', inputs, set())
+
+    assert row['sd of all voxels'] is None
+    assert row['note'] == 'file not found'
+
+
+def test_try_series_nii_calc_error(mocker):
+    """Errors give no output rows"""
+    mocker.patch('batch_niistats.modules.nii.series_nii_calc',
+                 side_effect=Exception("Test error"))
+    mock_print = mocker.patch("builtins.print")
+    result = nii.try_series_nii_calc('a.nii', 'a.nii', {}, {'a.nii'})
+
+    mock_print.assert_called_once_with("Error processing a.nii: Test error")
+    assert result == []
+
+
+@pytest.mark.parametrize("nii_file", ['tests/data/dki_kfa.nii',
+                                      'tests/data/fmri_4d.nii.gz'])
+def test_load_nii_from_raw_bytes(nii_file):
+    """Loading from bytes read ahead gives the same volume"""
+    raw_bytes = nii.try_read_nii_bytes(nii_file, {nii_file})
+    np.testing.assert_array_equal(nii.load_nii(nii_file, 0, raw_bytes),
+                                  nii.load_nii(nii_file, 0))
+
+
+def test_try_read_nii_bytes_missing():
+    assert nii.try_read_nii_bytes('missing.nii', {'other.nii'}) is None
+    assert nii.try_read_nii_bytes('missing.nii', {'missing.nii'}) is None
+
+
+@pytest.fixture(params=[(np.int16, 0.5, 10.0, '.nii'),
+                        (np.int16, -2.0, 0.0, '.nii.gz'),
+                        (np.uint8, 1.0, 0.3, '.nii'),
+                        (np.uint16, 0.25, -100.0, '.nii.gz')])
+def scaled_int_file(request, tmp_path):
+    """4D integer image with scl_slope/scl_inter and many scaled zeros"""
+    dtype, slope, inter, extension = request.param
+    rng = np.random.default_rng(1)
+    info = np.iinfo(dtype)
+    raw = rng.integers(max(info.min, -3000), min(info.max, 3000),
+                       size=(9, 8, 7, 3), endpoint=True).astype(dtype)
+    zero_value = -inter / slope
+    if zero_value == int(zero_value):
+        raw[::2] = int(zero_value)  # voxels that scale to exactly 0
+    img = nb.Nifti1Image(raw, np.eye(4), dtype=dtype)
+    img.header.set_slope_inter(slope, inter)
+    nii_file = str(tmp_path / f"scaled{extension}")
+    nb.save(img, nii_file)
+    return nii_file
+
+
+@pytest.mark.parametrize("inputs, expected_statistic, answer",
+                         list_of_inputs_to_decorate)
+def test_raw_stat_matches_scaled_volume(scaled_int_file, inputs,
+                                        expected_statistic, answer):
+    """Fast path on stored integers agrees with the get_fdata path"""
+    img_proxy = nii.open_nii(scaled_int_file)
+    for volume in range(3):
+        raw_volume = nii.get_raw_volume(img_proxy, volume)
+        scaled = nii.get_volume(img_proxy, volume)
+
+        assert raw_volume is not None
+        assert np.isclose(nii.calc_raw_stat(raw_volume, inputs),
+                          nii.calc_nii_stat(scaled, inputs),
+                          rtol=1e-12, atol=1e-12)
+
+
+def test_multi_nii_calc_uses_raw_path(mocker, scaled_int_file):
+    """Integer images never make a float copy of the volume"""
+    mock_get_volume = mocker.patch("batch_niistats.modules.nii.get_volume")
+    inputs = {"statistic": "sd", "omit_zeros": True}
+    result = nii.single_nii_calc(scaled_int_file, scaled_int_file, 1,
+                                 inputs, {scaled_int_file})
+
+    mock_get_volume.assert_not_called()
+    assert result['sd of nonzero voxels'] > 0
+
+
+def test_get_raw_volume_reads_one_volume(mocker, scaled_int_file):
+    """Only the requested volume of a local 4D file is read"""
+    spy_unscaled = mocker.spy(nb.arrayproxy.ArrayProxy, "get_unscaled")
+    img_proxy = nii.open_nii(scaled_int_file)
+    raw_array, slope, inter = nii.get_raw_volume(img_proxy, 2)
+
+    spy_unscaled.assert_not_called()
+    np.testing.assert_allclose(raw_array * slope + inter,
+                               nii.get_volume(img_proxy, 2))
+
+
+def test_get_raw_volume_float_data():
+    """Float images use the regular path"""
+    img_proxy = nii.open_nii('tests/data/dki_kfa.nii')
+    assert nii.get_raw_volume(img_proxy, 0) is None
+
+
+def test_raw_zero_value():
+    assert nii.raw_zero_value(np.dtype(np.int16), 0.5, 10.0) == -20
+    assert nii.raw_zero_value(np.dtype(np.int16), 1.0, 0.0) == 0
+    assert nii.raw_zero_value(np.dtype(np.int16), 1.0, 0.3) is None
+    assert nii.raw_zero_value(np.dtype(np.uint8), 1.0, 10.0) is None
+
+
+def test_raw_moments_slabs(mocker):
+    """Slab-wise sums are exact and don't depend on the slab size"""
+    raw = np.random.default_rng(2).integers(-32768, 32767, size=(5, 6, 40),
+                                            dtype=np.int16)
+    expected = nii.raw_moments(raw)
+    mocker.patch("batch_niistats.modules.nii.RAW_SLAB_VOXELS", 30)
+
+    assert nii.raw_moments(raw) == expected
+    assert expected == (raw.size,
+                        int(raw.astype(object).sum()),
+                        int((raw.astype(object) ** 2).sum()))
+    assert nii.raw_moments(raw, exclude=raw[0, 0, 0])[0] == \
+        np.count_nonzero(raw != raw[0, 0, 0])
+
+
+@pytest.mark.parametrize("inputs, expected_statistic, answer",
+                         list_of_inputs_to_decorate)
+def test_parallel_slabs_match_serial(mocker, inputs, expected_statistic,
+                                     answer):
+    """Large volumes reduced in parallel slabs give the same values"""
+    nii_array = nii.load_nii("tests/data/dki_kfa.nii", 0)
+    expected = nii.calc_nii_stat(nii_array, inputs)
+    mocker.patch("batch_niistats.modules.nii.PARALLEL_MIN_VOXELS", 1000)
+    mocker.patch("batch_niistats.modules.nii.PARALLEL_SLAB_VOXELS", 7919)
+    mock_pool = mocker.spy(nii, "get_slab_pool")
+
+    result = nii.calc_nii_stat(nii_array, inputs)
+
+    mock_pool.assert_called_once()
+    assert np.isclose(result, expected, rtol=1e-6)
+    assert np.isclose(result, answer, atol=1e-5)
+    # slabs are merged in a fixed order
+    assert nii.calc_nii_stat(nii_array, inputs) == result
+
+
+def test_parallel_slabs_empty_and_raw(mocker):
+    mocker.patch("batch_niistats.modules.nii.PARALLEL_MIN_VOXELS", 10)
+    mocker.patch("batch_niistats.modules.nii.PARALLEL_SLAB_VOXELS", 7)
+    assert np.isnan(nii.mean_nii(np.zeros((4, 4, 4)), True))
+    assert np.isnan(nii.sd_nii(np.zeros((4, 4, 4)), True))
+
+    raw = np.random.default_rng(3).integers(-300, 300, size=(6, 7, 20),
+                                            dtype=np.int16)
+    expected = (raw.size, int(raw.astype(np.int64).sum()),
+                int((raw.astype(np.int64) ** 2).sum()))
+    mocker.patch("batch_niistats.modules.nii.RAW_SLAB_VOXELS", 50)
+    assert nii.raw_moments(raw) == expected
+
+
+def test_combine_moments():
+    values = np.random.default_rng(4).normal(size=1000)
+    merged = nii.combine_moments(nii.slab_moments(values[:300], False),
+                                 nii.slab_moments(values[300:], False))
+
+    assert merged[0] == 1000
+    assert np.isclose(merged[1], values.mean())
+    assert np.isclose(merged[2], values.var() * 1000)
+    assert nii.combine_moments((0, 0.0, 0.0), (0, 0.0, 0.0)) == (0, 0.0, 0.0)
+
+
+@pytest.mark.parametrize("omit_zeros", [True, False])
+@pytest.mark.parametrize("axis, axis_index", [("x", 0), ("y", 1), ("z", 2)])
+def test_profile_stats_match_slices(omit_zeros, axis, axis_index):
+    """Per-slice axis reductions agree with mean_nii/sd_nii on each slice"""
+    nii_array = nii.load_nii("tests/data/dki_kfa.nii", 0)
+    means, sds = nii.profile_stats(nii_array, axis, omit_zeros)
+
+    assert means.shape == sds.shape == (nii_array.shape[axis_index],)
+    for index in range(0, nii_array.shape[axis_index], 7):
+        slice_array = np.take(nii_array, index, axis=axis_index)
+        if omit_zeros and not slice_array.any():
+            assert np.isnan(means[index]) and np.isnan(sds[index])
+            continue
+        assert np.isclose(means[index],
+                          nii.mean_nii(slice_array, omit_zeros))
+        assert np.isclose(sds[index], nii.sd_nii(slice_array, omit_zeros))
+
+
+def test_profile_nii_calc_loads_once(mocker):
+    """Every axis is profiled from a single load, in long format"""
+    mock_load = mocker.spy(nii, "load_nii")
+    rows = nii.profile_nii_calc("tests/data/fmri_4d.nii.gz,2",
+                                "tests/data/fmri_4d.nii.gz", 1, ("z", "x"),
+                                True, {"tests/data/fmri_4d.nii.gz"})
+
+    mock_load.assert_called_once_with("tests/data/fmri_4d.nii.gz", 1)
+    assert len(rows) == 72 + 72
+    assert [row["axis"] for row in rows] == ["z"] * 72 + ["x"] * 72
+    assert rows[72]["slice_0basedindex"] == 0
+    assert set(rows[0]) == {"input_file", "filename", "volume_0basedindex",
+                            "axis", "slice_0basedindex",
+                            "mean of nonzero voxels", "sd of nonzero voxels",
+                            "note"}
+
+
+def test_profile_nii_calc_nonexistentfile(mocker):
+    mocker.patch("builtins.print")
+    [row] = nii.profile_nii_calc("missing.nii", "missing.nii", 0, ("z",),
+                                 False, set())
+
+    assert row["note"] == "file not found"
+    assert row["mean of all voxels"] is None
+
+
+def test_try_profile_nii_calc_error(mocker):
+    mocker.patch("batch_niistats.modules.nii.load_nii",
+                 side_effect=Exception("Test error"))
+    mock_print = mocker.patch("builtins.print")
+
+    assert nii.try_profile_nii_calc("a.nii", "a.nii", 0, ("z",), True,
+                                    {"a.nii"}) == []
+    mock_print.assert_called_with("Error processing a.nii: Test error")
+
+
+@pytest.mark.parametrize("nii_file, nii_volume",
+                         [("tests/data/dki_kfa.nii", 0),
+                          ("tests/data/fmri_4d.nii.gz", 1)])
+@pytest.mark.parametrize("inputs, expected_statistic, answer",
+                         list_of_inputs_to_decorate)
+def test_approx_default_step_within_half_percent(nii_file, nii_volume,
+                                                 inputs, expected_statistic,
+                                                 answer):
+    """At the default step, estimates are within 0.5% of mean_nii/sd_nii
+    for every sample offset; step 1 is exact"""
+    nii_array = nii.load_nii(nii_file, nii_volume)
+    exact = nii.calc_nii_stat(nii_array, inputs)
+    exclude = 0 if inputs["omit_zeros"] else None
+
+    value, se = nii.approx_stat(
+        nii.approx_moments(nii_array, 1, 0, exclude), inputs, 1)
+    assert np.isclose(value, exact, rtol=1e-9) and se == 0
+
+    step = nii.APPROX_STEP
+    for start in range(step):
+        value, se = nii.approx_stat(
+            nii.approx_moments(nii_array, step, start, exclude),
+            inputs, step)
+        assert abs(value / exact - 1) < 0.005
+
+
+@pytest.mark.parametrize("nii_file, nii_volume",
+                         [("tests/data/dki_kfa.nii", 0),
+                          ("tests/data/fmri_4d.nii.gz", 1)])
+@pytest.mark.parametrize("inputs, expected_statistic, answer",
+                         list_of_inputs_to_decorate)
+def test_approx_standard_error_matches_spread(nii_file, nii_volume,
+                                              inputs, expected_statistic,
+                                              answer):
+    """The standard error is close to the actual error of the estimates
+    across all sample offsets"""
+    nii_array = nii.load_nii(nii_file, nii_volume)
+    exact = nii.calc_nii_stat(nii_array, inputs)
+    exclude = 0 if inputs["omit_zeros"] else None
+
+    step = 8
+    values, ses = np.array([
+        nii.approx_stat(nii.approx_moments(nii_array, step, start, exclude),
+                        inputs, step)
+        for start in range(step)]).T
+    rms_error = np.sqrt(np.mean(np.square(values - exact)))
+    assert 0.5 < np.mean(ses) / rms_error < 2
+
+
+def test_approx_nii_calc_fmri():
+    """approx_nii_calc at the default step on a 4D image"""
+    inputs = {"statistic": "mean", "omit_zeros": True}
+    result = nii.approx_nii_calc("tests/data/fmri_4d.nii.gz,2",
+                                 "tests/data/fmri_4d.nii.gz", 1, inputs,
+                                 {"tests/data/fmri_4d.nii.gz"})
+    exact = nii.single_nii_calc("tests/data/fmri_4d.nii.gz,2",
+                                "tests/data/fmri_4d.nii.gz", 1, inputs,
+                                {"tests/data/fmri_4d.nii.gz"})
+
+    estimate = result["mean of nonzero voxels"]
+    assert abs(estimate / exact["mean of nonzero voxels"] - 1) < 0.005
+    assert 0 < result["standard error of mean of nonzero voxels"]
+    assert result["note"] == "file exists"
+
+
+@pytest.mark.parametrize("inputs", [{"statistic": "mean", "omit_zeros": True},
+                                    {"statistic": "sd", "omit_zeros": False}])
+def test_approx_nii_calc_scaled_int(scaled_int_file, inputs, mocker):
+    """Integer images are sampled as stored; step 1 gives the exact value
+    after scaling"""
+    label = nii.stat_label(inputs)
+    exact = nii.calc_nii_stat(nii.load_nii(scaled_int_file, 1), inputs)
+    spy_raw = mocker.spy(nii, "get_raw_volume")
+
+    result = nii.approx_nii_calc(scaled_int_file, scaled_int_file, 1,
+                                 inputs, {scaled_int_file}, step=1)
+
+    assert spy_raw.spy_return is not None
+    assert np.isclose(result[label], exact, rtol=1e-9)
+    assert result[f"standard error of {label}"] == 0
+
+
+def test_approx_nii_calc_nonexistent_and_empty(mocker):
+    mocker.patch("builtins.print")
+    inputs = {"statistic": "sd", "omit_zeros": True}
+    result = nii.approx_nii_calc("missing.nii", "missing.nii", 0, inputs,
+                                 set())
+    assert result["sd of nonzero voxels"] is None
+    assert result["note"] == "file not found"
+
+    value, se = nii.approx_stat(
+        nii.approx_moments(np.zeros((4, 4, 4)), 2, 0, 0), inputs, 2)
+    assert np.isnan(value) and np.isnan(se)
@@ -0,0 +1,71 @@
+import threading
+import time
+import pytest
+from batch_niistats.modules import pipeline
+
+
+def test_staged_map_keeps_order():
+    """Results come back in input order even if items finish out of order"""
+    def read(item):
+        time.sleep(0.001 * (10 - item))
+        return item * 2
+
+    result = pipeline.staged_map(read, lambda item, raw: (item, raw),
+                                 range(10), io_workers=4, compute_workers=2)
+
+    assert result == [(item, item * 2) for item in range(10)]
+
+
+def test_staged_map_bounds_items_in_flight():
+    """Reading pauses while max_inflight items wait to be computed"""
+    lock = threading.Lock()
+    in_flight = [0]
+    peak = [0]
+
+    def read(item):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        return item
+
+    def compute(item, raw):
+        time.sleep(0.005)  # compute is the bottleneck
+        with lock:
+            in_flight[0] -= 1
+        return raw
+
+    result = pipeline.staged_map(read, compute, range(30),
+                                 io_workers=8, compute_workers=1,
+                                 max_inflight=3)
+
+    assert result == list(range(30))
+    assert peak[0] <= 3
+
+
+def test_staged_map_overlaps_reading_and_compute():
+    """Slow reads and slow compute run at the same time"""
+    def read(item):
+        time.sleep(0.02)
+        return item
+
+    def compute(item, raw):
+        time.sleep(0.02)
+        return raw
+
+    start = time.perf_counter()
+    pipeline.staged_map(read, compute, range(10),
+                        io_workers=10, compute_workers=10)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 10 * 0.04 / 2  # far below running them back to back
+
+
+@pytest.mark.parametrize("stage", ["read", "compute"])
+def test_staged_map_raises_errors(stage):
+    def fail(*args):
+        raise RuntimeError("Test error")
+    read = fail if stage == "read" else (lambda item: item)
+    compute = fail if stage == "compute" else (lambda item, raw: raw)
+
+    with pytest.raises(RuntimeError, match="Test error"):
+        pipeline.staged_map(read, compute, range(5), max_inflight=2)
@@ -0,0 +1,48 @@
+import os
+import pytest
+from batch_niistats.modules import schedule
+
+
+def test_estimate_cost():
+    """Costs come from the header: one volume, or the whole .gz series"""
+    assert schedule.estimate_cost("tests/data/dki_kfa.nii") == \
+        schedule.estimate_cost("tests/data/dki_kfa.nii.gz")
+    volume_bytes = 72 * 87 * 72 * 4
+    assert schedule.estimate_cost("tests/data/fmri_4d.nii.gz") == \
+        2 * volume_bytes
+    assert schedule.estimate_cost("tests/data/missing.nii") == 0
+
+
+def test_locality_key():
+    directory, inode = schedule.locality_key("tests/data/dki_kfa.nii")
+    assert directory == "tests/data"
+    assert inode == os.stat("tests/data/dki_kfa.nii").st_ino
+    assert schedule.locality_key("tests/data/missing.nii") == \
+        ("tests/data", 0)
+
+
+def test_cost_order_largest_tier_first():
+    """Large rows start first; similar sizes are grouped by directory"""
+    costs = {"a/small1.nii": 1030, "b/small2.nii": 1100,
+             "a/small3.nii": 1050, "c/big.nii": 10 ** 9,
+             "a/missing.nii": 0}
+    rows = [("a/small1.nii", "a/small1.nii", 0),
+            ("b/small2.nii", "b/small2.nii", 0),
+            ("a/small3.nii,2", "a/small3.nii", 1),
+            ("a/small3.nii", "a/small3.nii", 0),
+            ("a/missing.nii", "a/missing.nii", 0),
+            ("c/big.nii", "c/big.nii", 0)]
+    order = schedule.cost_order(rows,
+                                cost=lambda f, all_volumes: costs[f])
+
+    assert [rows[index][0] for index in order] == \
+        ["c/big.nii", "a/small1.nii", "a/small3.nii", "a/small3.nii,2",
+         "b/small2.nii", "a/missing.nii"]
+
+
+@pytest.mark.parametrize("order", [[2, 0, 1], [0, 1, 2], [1, 2, 0]])
+def test_restore_order(order):
+    rows = ["x", "y", "z"]
+    results = [rows[index].upper() for index in order]
+
+    assert schedule.restore_order(results, order) == ["X", "Y", "Z"]
@@ -0,0 +1,166 @@
+import os
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from batch_niistats import cli, client
+from batch_niistats.modules import server
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"),
+                                reason="needs Unix-domain sockets")
+
+
+@pytest.fixture
+def daemon(tmp_path, mocker):
+    """Daemon serving on a temporary socket in a background thread"""
+    mocker.patch("builtins.print")
+    socket_path = str(tmp_path / "niistats.sock")
+    batch_server = server.BatchServer(socket_path, workers=2)
+    thread = threading.Thread(target=batch_server.serve_forever,
+                              daemon=True)
+    thread.start()
+    yield socket_path
+    batch_server.shutdown()
+    thread.join()
+    batch_server.server_close()
+
+
+def test_submit_matches_cli_table(daemon):
+    """The daemon returns the table create_output_df produces"""
+    result = client.submit("tests/data/sample_datalist.csv", "M",
+                           socket_path=daemon)
+    table = pd.DataFrame(result["data"], columns=result["columns"])
+
+    assert result["output_path"] is None
+    assert list(table.columns) == ["input_file", "filename",
+                                   "volume_0basedindex",
+                                   "mean of nonzero voxels", "note"]
+    assert np.allclose(table["mean of nonzero voxels"].astype(float),
+                       [1037.736913, 1037.729177, 1037.736913,
+                        0.279955, 0.279955, np.nan],
+                       atol=0.01, equal_nan=True)
+    assert table.loc[5, "note"] == "file not found"
+
+
+def test_submit_saves_csv_next_to_datalist(daemon, tmp_path):
+    datalist = tmp_path / "datalist.csv"
+    datalist.write_text(
+        f"input_file\n{os.path.abspath('tests/data/dki_kfa.nii')}\n")
+    result = client.submit(str(datalist), "s", socket_path=daemon,
+                           save=True)
+
+    assert result["output_path"].startswith(str(tmp_path))
+    assert result["output_path"].endswith("datalist_calc_s.csv")
+    saved = pd.read_csv(result["output_path"])
+    assert np.isclose(saved.loc[0, "sd of all voxels"], 0.148956, atol=1e-5)
+
+
+def test_errors_and_ping(daemon):
+    assert client.ping(daemon)
+    assert stat.S_IMODE(os.stat(daemon).st_mode) == 0o600
+    with pytest.raises(RuntimeError, match="Unsupported option"):
+        client.submit(["tests/data/dki_kfa.nii"], "X", socket_path=daemon)
+    assert client.request({"command": "nope"}, daemon)["ok"] is False
+    assert not client.ping(daemon + ".missing")
+
+
+def test_shutdown_request(tmp_path, mocker):
+    mocker.patch("builtins.print")
+    socket_path = str(tmp_path / "niistats.sock")
+    mocker.patch("sys.argv", ["batch_niistats", "serve",
+                              "--socket", socket_path, "--workers", "1"])
+    thread = threading.Thread(target=cli.main, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not client.ping(socket_path):
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+    client.shutdown(socket_path)
+    thread.join(10)
+
+    assert not thread.is_alive()
+    assert not os.path.exists(socket_path)
+
+
+def test_stale_socket_is_removed(tmp_path, daemon):
+    stale = tmp_path / "stale.sock"
+    stale.touch()
+    server.remove_stale_socket(str(stale))
+    assert not stale.exists()
+    with pytest.raises(RuntimeError):
+        server.remove_stale_socket(daemon)
+
+
+def test_fair_scheduler_round_robin():
+    """A small job submitted after a large one isn't stuck behind it"""
+    scheduler = server.FairScheduler(workers=1)
+    finished = []
+
+    def slow(item):
+        time.sleep(0.01)
+        return item * 2
+
+    def run(name, items):
+        assert scheduler.map(slow, items) == [item * 2 for item in items]
+        finished.append(name)
+
+    large = threading.Thread(target=run, args=("large", range(50)))
+    large.start()
+    time.sleep(0.05)
+    small = threading.Thread(target=run, args=("small", range(3)))
+    small.start()
+    large.join()
+    small.join()
+    scheduler.shutdown()
+
+    assert finished == ["small", "large"]
+
+
+def test_fair_scheduler_errors_and_empty_jobs():
+    scheduler = server.FairScheduler(workers=2)
+    assert scheduler.map(str, []) == []
+    with pytest.raises(ZeroDivisionError):
+        scheduler.map(lambda item: 1 / item, [1, 0, 2])
+    assert scheduler.map(abs, [-1, -2]) == [1, 2]
+
+    def fail(item):
+        time.sleep(0.05 if item == 2 else 0)
+        if item:
+            raise ValueError(item)
+
+    # item 2 fails last, but item 1's error is the one raised
+    with pytest.raises(ValueError, match="1"):
+        scheduler.map(fail, [0, 1, 2])
+    scheduler.shutdown()
+    with pytest.raises(RuntimeError):
+        scheduler.map(abs, [1])
+
+
+def test_client_main(daemon, tmp_path, mocker):
+    datalist = tmp_path / "datalist.csv"
+    datalist.write_text(
+        f"input_file\n{os.path.abspath('tests/data/dki_kfa.nii')}\n")
+    mocker.patch("sys.argv", ["batch_niistats_client", "M", str(datalist),
+                              "--socket", daemon])
+    assert client.main() == 0
+    assert len(list(tmp_path.glob("*_calc_M.csv"))) == 1
+
+    mocker.patch("sys.argv", ["batch_niistats_client", "M", str(datalist),
+                              "--socket", daemon + ".missing"])
+    mocker.patch("sys.stderr")
+    assert client.main() == 1
+
+
+def test_client_does_not_import_pandas():
+    """The client starts without loading the heavy libraries"""
+    code = ("import sys, batch_niistats.client; "
+            "print('pandas' in sys.modules or 'nibabel' in sys.modules)")
+    output = subprocess.run([sys.executable, "-c", code],
+                            capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "False"
@@ -0,0 +1,124 @@
+import gzip
+import os
+import threading
+import nibabel as nb
+import numpy as np
+import pytest
+from batch_niistats.modules import api, nii, storage
+
+
+class CountingFileSystem:
+    """In-memory backend that counts requests and bytes transferred"""
+
+    def __init__(self, files):
+        self.files = files
+        self.bytes_read = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def exists(self, path):
+        return path in self.files
+
+    def size(self, path):
+        return len(self.files[path])
+
+    def cat_file(self, path, start=None, end=None):
+        data = self.files[path][start:end]
+        with self._lock:
+            self.bytes_read += len(data)
+            self.requests += 1
+        return data
+
+
+@pytest.fixture
+def mock_fs(tmp_path):
+    """Backend for mock:// URLs holding an uncompressed and a gzipped 4D
+    file and an int16 4D file with scaling"""
+    with gzip.open("tests/data/fmri_4d.nii.gz", "rb") as f:
+        fmri = f.read()
+    raw = np.random.default_rng(0).integers(
+        -500, 500, size=(20, 30, 10, 6)).astype(np.int16)
+    img = nb.Nifti1Image(raw, np.eye(4), dtype=np.int16)
+    img.header.set_slope_inter(0.5, 3.0)
+    nb.save(img, tmp_path / "scaled.nii")
+
+    fs = CountingFileSystem({
+        "mock://fmri_4d.nii": fmri,
+        "mock://fmri_4d.nii.gz": gzip.compress(fmri),
+        "mock://scaled.nii": (tmp_path / "scaled.nii").read_bytes()})
+    storage.register_filesystem("mock", fs)
+    yield fs
+    del storage._FILESYSTEMS["mock"]
+
+
+def test_split_protocol():
+    assert storage.split_protocol("data/file.nii") == \
+        ("file", "data/file.nii")
+    assert storage.split_protocol("file:///data/file.nii") == \
+        ("file", "/data/file.nii")
+    assert storage.split_protocol("s3://bucket/file.nii") == \
+        ("s3", "s3://bucket/file.nii")
+    assert not storage.is_url("C:\\data\\file.nii")
+    assert storage.local_path("file:///data/file.nii") == "/data/file.nii"
+    assert storage.local_path("s3://bucket/file.nii") == \
+        "s3://bucket/file.nii"
+
+
+@pytest.mark.parametrize("volume", [0, 1])
+def test_load_nii_reads_only_requested_volume(mock_fs, volume):
+    """An uncompressed URL fetches the header and one volume"""
+    expected = nii.load_nii("tests/data/fmri_4d.nii.gz", volume)
+    data_array = nii.load_nii("mock://fmri_4d.nii", volume)
+
+    volume_bytes = 72 * 87 * 72 * 4
+    assert np.array_equal(data_array, expected)
+    assert volume_bytes <= mock_fs.bytes_read < volume_bytes + 4096
+
+
+def test_raw_path_reads_only_requested_volume(mock_fs, tmp_path):
+    """Integer URLs use the raw fast path on a single volume's bytes"""
+    inputs = {"statistic": "sd", "omit_zeros": False}
+    result = nii.single_nii_calc("mock://scaled.nii,4", "mock://scaled.nii",
+                                 4, inputs, {"mock://scaled.nii"})
+    expected = nii.calc_nii_stat(
+        nii.load_nii(str(tmp_path / "scaled.nii"), 4), inputs)
+
+    assert np.isclose(result["sd of all voxels"], expected, rtol=1e-12)
+    assert 20 * 30 * 10 * 2 <= mock_fs.bytes_read < 20 * 30 * 10 * 2 + 4096
+
+
+def test_gzipped_url_is_read_whole(mock_fs):
+    """Gzipped files can't be read in ranges, they are fetched once"""
+    data_array = nii.load_nii("mock://fmri_4d.nii.gz", 1)
+
+    assert np.array_equal(data_array,
+                          nii.load_nii("tests/data/fmri_4d.nii.gz", 1))
+    assert mock_fs.requests == 1
+
+
+def test_compute_urls(mock_fs):
+    """URLs work through the python API, including missing ones"""
+    result = api.compute(["mock://fmri_4d.nii,2", "mock://missing.nii"],
+                         stats="m")
+
+    assert np.allclose(result["mean of all voxels"], [880.965823, np.nan],
+                       atol=0.01, equal_nan=True)
+    assert result.loc[1, "note"] == "file not found"
+
+
+def test_compute_file_urls():
+    """file:// paths are read as local files"""
+    url = "file://" + os.path.abspath("tests/data/dki_kfa.nii")
+    result = api.compute([url, url + ".missing"], stats="S")
+
+    assert storage.exists(url)
+    assert np.allclose(result["sd of nonzero voxels"], [0.174158, np.nan],
+                       atol=1e-5, equal_nan=True)
+    assert list(result["note"]) == ["file exists", "file not found"]
+
+
+def test_unknown_protocol(mocker):
+    mocker.patch("batch_niistats.modules.storage.fsspec", None)
+    with pytest.raises(ValueError):
+        storage.get_filesystem("nope://bucket/file.nii")
+    assert not storage.exists("nope://bucket/file.nii")
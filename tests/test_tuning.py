@@ -0,0 +1,51 @@
+import hashlib
+import time
+from batch_niistats.modules import tuning
+
+
+def test_adaptive_workers_keeps_order(mocker):
+    mocker.patch("builtins.print")
+    tuner = tuning.AdaptiveWorkers(max_workers=8, n_cpus=2)
+    result = tuner.map(lambda item: item ** 2, range(50))
+
+    assert result == [item ** 2 for item in range(50)]
+
+
+def test_adaptive_workers_grows_for_io_bound_tasks(mocker):
+    """Tasks that mostly wait get more workers than CPUs"""
+    mock_print = mocker.patch("builtins.print")
+    tuner = tuning.AdaptiveWorkers(max_workers=16, n_cpus=2, window=8)
+    tuner.map(lambda item: time.sleep(0.01), range(120))
+
+    assert tuner.workers > 2
+    assert tuner.history[0][1] > 0.5  # mostly io wait
+    assert "--workers" in mock_print.call_args_list[-1][0][0]
+
+
+def test_adaptive_workers_does_not_oversubscribe_cpu(mocker):
+    """Tasks that keep the CPU busy stay at about one worker per CPU"""
+    mocker.patch("builtins.print")
+    data = b"x" * 2 ** 20
+
+    def busy(item):
+        for _ in range(4):
+            hashlib.sha256(data).digest()
+
+    tuner = tuning.AdaptiveWorkers(max_workers=16, n_cpus=1, window=6)
+    tuner.map(busy, range(60))
+
+    assert tuner.workers <= 2
+
+
+def test_adaptive_workers_undoes_slower_change(mocker):
+    """A change that lowers throughput is reverted and not retried"""
+    mocker.patch("builtins.print")
+    tuner = tuning.AdaptiveWorkers(max_workers=16, n_cpus=2, window=4)
+    tuner._last_change = (2, 100.0)  # went 2 -> 8, at 100 files/s before
+    tuner.workers = 8
+    tuner._done, tuner._task_wall, tuner._task_cpu = 4, 1.0, 0.0
+    tuner._window_start = time.perf_counter() - 1.0  # now 4 files/s
+    tuner._retune()
+
+    assert tuner.workers == 2
+    assert tuner._high == 7
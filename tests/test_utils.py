@@ -1,3 +1,4 @@
+import argparse
 import os
 import pytest
 from batch_niistats.modules import utils
@@ -237,3 +238,64 @@ def test_save_output_csv(mocker):
     # Assert that the print statement w the expected output message
     expected_print_message = f"\nOutput saved to file:\n{output_path}\n"
     mock_print.assert_called_once_with(expected_print_message)
+
+
+def test_create_series_output_df():
+    """Input rows are repeated for every output row, in input order"""
+    datalist = pd.DataFrame({"input_file": ["b.nii", "a.nii", "c.nii"],
+                             "file": ["b.nii", "a.nii", "c.nii"],
+                             "volume_0basedindex": [0, 0, 0],
+                             "subject": ["s1", "s2", "s3"]})
+    list_of_lists = [
+        [{"input_file": "b.nii", "volume_0basedindex": v, "value": v}
+         for v in range(3)],
+        [],
+        [{"input_file": "c.nii", "volume_0basedindex": 0, "value": 9}],
+    ]
+    result = utils.create_series_output_df(datalist, list_of_lists)
+
+    assert result["input_file"].tolist() == ["b.nii"] * 3 + ["a.nii",
+                                                             "c.nii"]
+    assert result["subject"].tolist() == ["s1"] * 3 + ["s2", "s3"]
+    assert result["volume_0basedindex"].tolist()[:3] == [0, 1, 2]
+    assert np.isnan(result.loc[3, "value"])
+
+
+def test_create_series_output_df_all_empty():
+    """If no row has output, the datalist is returned"""
+    datalist = pd.DataFrame({"input_file": ["a.nii"], "file": ["a.nii"]})
+    result = utils.create_series_output_df(datalist, [[]])
+
+    assert result["input_file"].tolist() == ["a.nii"]
+
+
+def test_parse_positive_int():
+    assert utils.parse_positive_int("3") == 3
+    for value in ["0", "-1", "auto", "1.5"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            utils.parse_positive_int(value)
+
+
+def test_parse_workers():
+    assert utils.parse_workers("auto") == "auto"
+    assert utils.parse_workers("4") == 4
+    for value in ["0", "-2", "many"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            utils.parse_workers(value)
+
+
+def test_parse_size():
+    assert utils.parse_size("500") == 500
+    assert utils.parse_size("10G") == 10 * 1024 ** 3
+    assert utils.parse_size("1.5mb") == int(1.5 * 1024 ** 2)
+    for value in ["0", "-1G", "lots", "G", "inf", "nan"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            utils.parse_size(value)
+
+
+def test_parse_axes():
+    assert utils.parse_axes("z") == ("z",)
+    assert utils.parse_axes("X, y,z,y") == ("x", "y", "z")
+    for value in ["", "t", "x,w"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            utils.parse_axes(value)
@@ -0,0 +1,81 @@
+import os
+import shutil
+import pandas as pd
+from batch_niistats.modules import discover, utils, watch
+
+inputs = {"statistic": "mean", "omit_zeros": True}
+
+
+def test_watch_processes_only_new_or_changed_files(mocker, tmp_path):
+    """Each poll calculates only rows that are new or changed"""
+    mocker.patch("builtins.print")
+    watch_dir = tmp_path / "incoming"
+    watch_dir.mkdir()
+    output_path = str(tmp_path / "output.csv")
+    first = watch_dir / "a.nii"
+    shutil.copy("tests/data/dki_kfa.nii", first)
+
+    def arrivals(interval):
+        if not (watch_dir / "b.nii.gz").exists():
+            shutil.copy("tests/data/fmri_4d.nii.gz", watch_dir / "b.nii.gz")
+        else:
+            stat = os.stat(first)
+            os.utime(first, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+    mocker.patch("batch_niistats.modules.watch.time.sleep",
+                 side_effect=arrivals)
+    calc = mocker.patch("batch_niistats.modules.watch.api.try_multi_nii_calc",
+                        wraps=watch.api.try_multi_nii_calc)
+
+    def load_rows():
+        return utils.datalist_from_files(
+            sorted(discover.iter_nii_files([str(watch_dir)])))
+
+    n_rows = watch.watch(load_rows, inputs, output_path,
+                         interval=0.1, settle=0, max_polls=3)
+
+    output = pd.read_csv(output_path)
+    assert n_rows == 3
+    assert [os.path.basename(call[0][1]) for call in calc.call_args_list] \
+        == ["a.nii", "b.nii.gz", "a.nii"]
+    assert output.shape == (3, 5)
+    assert output["mean of nonzero voxels"].round(3).tolist() == \
+        [0.28, 1037.737, 0.28]
+
+
+def test_find_changed_rows_waits_for_files_to_settle(tmp_path):
+    """Files that were just written, or don't exist, are left for later"""
+    nii_file = str(tmp_path / "a.nii")
+    shutil.copy("tests/data/dki_kfa.nii", nii_file)
+    datalist = utils.datalist_from_files([nii_file, str(tmp_path / "b.nii")])
+
+    changed, _ = watch.find_changed_rows(datalist, {}, settle=60)
+    assert changed.empty
+
+    changed, signatures = watch.find_changed_rows(datalist, {}, settle=0)
+    assert changed["file"].tolist() == [nii_file]
+    assert signatures == [watch.file_signature(nii_file)]
+
+    seen = {(nii_file, nii_file, 0): signatures[0]}
+    changed, _ = watch.find_changed_rows(datalist, seen, settle=0)
+    assert changed.empty
+
+
+def test_watch_survives_unreadable_datalist(mocker, tmp_path):
+    mock_print = mocker.patch("builtins.print")
+    mocker.patch("batch_niistats.modules.watch.time.sleep")
+    load_rows = mocker.Mock(side_effect=OSError("busy"))
+
+    n_rows = watch.watch(load_rows, inputs, str(tmp_path / "out.csv"),
+                         max_polls=2)
+
+    assert n_rows == 0
+    assert load_rows.call_count == 2
+    mock_print.assert_any_call("Could not read the list of files: busy")
+
+
+def test_watch_stops_on_keyboard_interrupt(mocker, tmp_path):
+    mock_print = mocker.patch("builtins.print")
+    load_rows = mocker.Mock(side_effect=KeyboardInterrupt)
+
+    assert watch.watch(load_rows, inputs, str(tmp_path / "out.csv")) == 0
+    mock_print.assert_called_with("Stopped watching.")